@@ -0,0 +1,278 @@
+"""Command-line entry point for the experiments of both parts.
+
+    python cli.py hubs --k 5 10 --r 2
+    python cli.py cluster --k 12 --iters 3 --no-plots
+    python cli.py --config experiments.json center
+    python cli.py cluster --workers 4 --no-plots --metrics metrics.json --trace trace.json
+
+Options can also be given in a JSON config file, with one object of options per command, e.g.
+{"hubs": {"k": [5, 10], "r": [2]}, "cluster": {"workers": 4}}.  Options given on the command line take
+precedence.  Each command only imports the modules it runs, and matplotlib is only loaded by the
+background plotting workers, so compute-only runs start quickly.
+"""
+import os
+import sys
+import json
+import argparse
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+PART_1 = os.path.join(ROOT, "part_1")
+PART_2 = os.path.join(ROOT, "part_2")
+
+# The trajectory pairs and the center trajectories of the case study.  The hubs and simplify defaults only run
+# one of the configurations in the __main__ blocks of hubs.py and tsgreedy.py; pass the others as options.
+ALIGN_PAIRS = ["128-20080503104400", "128-20080509135846", "010-20081016113953", "010-20080923124453", "115-20080520225850", "115-20080615225707"]
+CENTER_TIDS = [
+    "115-20080527225031", "115-20080528230807", "115-20080618225237", "115-20080624022857",
+    "115-20080626014331", "115-20080626224815", "115-20080701030733", "115-20080701225507",
+    "115-20080702225600", "115-20080706230401", "115-20080707230001",
+]
+
+
+def use_part(part):
+    """Makes the modules of part importable.  The parts have modules of the same names, so a run only ever uses one."""
+    if part not in sys.path:
+        sys.path.insert(0, part)
+
+
+def figures(args, part, task):
+    """Returns the figure directory of the run, creating it if plots are drawn."""
+    fig_dir = args.figures or os.path.join(part, "figures", task)
+    if not args.no_plots:
+        os.makedirs(fig_dir, exist_ok=True)
+    return fig_dir
+
+
+def run_hubs(args):
+    use_part(PART_1)
+    import hubs
+
+    fig_dir = figures(args, PART_1, "task_1")
+    for csv_path in args.csv:
+        name = os.path.splitext(os.path.basename(csv_path))[0]
+        for k in args.k:
+            for r in args.r:
+                print(f"{name}, k = {k}, r = {r:g}:")
+                print("-----------------------------")
+                hubs.timing(csv_path, os.path.join(fig_dir, f"{name}_{k}_{r:g}.png"), args.binwidth, args.binheight, k, r, args.iters)
+
+
+def run_simplify(args):
+    use_part(PART_1)
+    import tsgreedy
+
+    fig_dir = figures(args, PART_1, "task_2")
+    for Tid in args.tids:
+        tsgreedy.experiment(args.csv, fig_dir, Tid, args.epsilons)
+
+
+def run_align(args):
+    use_part(PART_1)
+    import align
+
+    if len(args.pairs) % 2:
+        raise ValueError("--pairs takes an even number of trajectory ids")
+
+    fig_dir = figures(args, PART_1, "task_3")
+    for Pid, Qid in zip(args.pairs[::2], args.pairs[1::2]):
+        align.experiment(args.csv, fig_dir, Pid, Qid, args.epsilons, args.radii)
+
+
+def run_center(args):
+    use_part(PART_2)
+    import center
+    from cache import DTWCache
+
+    fig_dir = figures(args, PART_2, "task_4")
+    cache = DTWCache(path=args.cache) if args.cache else None
+    try:
+        center.experiment(args.csv, fig_dir, set(args.tids), args.epsilons, cache)
+    finally:
+        if cache is not None:
+            cache.close()
+            print(f"DTW cache: {cache.stats()}")
+
+
+def run_cluster(args):
+    use_part(PART_2)
+    import cluster
+    from cache import DTWCache
+    from stream import stream_trajectories
+    from utils import ts_greedy
+
+    fig_dir = figures(args, PART_2, "task_5")
+
+    if args.nodes:
+        run_distributed_cluster(args, fig_dir)
+        return
+
+    # Trajectories are simplified as they stream in, so the raw points are never all held in memory unless their rows are unsorted
+    trajectories = {tid : ts_greedy(trajectory, args.epsilon) for tid, trajectory in stream_trajectories(args.csv, contiguous = not args.unsorted)}
+
+    cache = DTWCache(path=args.cache) if args.cache else None
+    try:
+        cluster.experiment(trajectories, fig_dir, args.k, args.t_max, args.iters, args.workers or os.cpu_count() or 1, cache, args.batch_size)
+    finally:
+        if cache is not None:
+            cache.close()
+            print(f"DTW cache: {cache.stats()}")
+
+
+def run_distributed_cluster(args, fig_dir):
+    """Clusters on worker nodes that each read their own shard of the csv file.  --nodes is a number of local worker processes, or the HOST:PORT addresses of running workers."""
+    import cluster
+    from distributed import AUTHKEY_VARIABLE, Coordinator, environment_authkey, start_worker
+
+    authkey = args.authkey.encode() if args.authkey else environment_authkey()
+    if len(args.nodes) == 1 and args.nodes[0].isdigit():
+        # Local workers share a secret made up for this run, unless one is given
+        authkey = authkey or os.urandom(16)
+        processes, addresses = zip(*[start_worker(authkey) for _ in range(int(args.nodes[0]))])
+    else:
+        if authkey is None:
+            raise ValueError(f"remote workers need their shared secret, from --authkey or {AUTHKEY_VARIABLE}")
+        processes, addresses = (), [(host, int(port)) for host, port in (node.rsplit(":", 1) for node in args.nodes)]
+
+    coordinator = Coordinator.from_csv(args.csv, list(addresses), authkey, args.epsilon)
+    try:
+        cluster.experiment(None, fig_dir, args.k, args.t_max, args.iters, coordinator = coordinator)
+    finally:
+        # Local workers are stopped, remote ones keep their shards for the next run
+        coordinator.close(stop = bool(processes))
+        print(f"Worker restarts: {coordinator.restarts}")
+
+
+def run_search(args):
+    use_part(PART_2)
+    from search import SimilarityIndex
+
+    index = SimilarityIndex.from_csv(args.csv, window=args.window, slope=args.slope)
+    tids = args.tids or index.tids[:args.queries]
+    queries = {tid : index.arrays[index.tids.index(tid)] for tid in tids}
+
+    for tid, result in index.search(queries, args.k).items():
+        print(f"{tid}: {[(round(distance, 6), match) for distance, match in result]}")
+    print(f"Search: {index.stats()}")
+
+
+def build_parser():
+    """Returns the argument parser and its parser per command."""
+    parser = argparse.ArgumentParser(description="Runs the experiments of the case study.")
+    parser.add_argument("--config", help="JSON file with default options per command")
+    commands = parser.add_subparsers(dest="command", required=True, metavar="command")
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--figures", help="directory the figures are saved to (default: figures/task_n in the directory of the part)")
+    common.add_argument("--no-plots", action="store_true", help="skip plotting")
+    common.add_argument("--instrument", action="store_true", help="count DTW calls and cells, time the hot paths, and print the counters at the end")
+    common.add_argument("--metrics", metavar="PATH", help="write the counters, timers and recorded values to PATH as JSON (implies --instrument)")
+    common.add_argument("--trace", metavar="PATH", help="write the timed spans to PATH in the Chrome trace event format (implies --instrument)")
+
+    data_1 = os.path.join(PART_1, "data", "geolife-cars.csv")
+    data_2 = os.path.join(PART_2, "data", "geolife-cars-upd8.csv")
+
+    hubs = commands.add_parser("hubs", parents=[common], help="detect hubs and time the detection (task 1)")
+    hubs.add_argument("--csv", nargs="+", default=[data_1], help="datasets to run on")
+    hubs.add_argument("--k", type=int, nargs="+", default=[10], help="numbers of hubs")
+    hubs.add_argument("--r", type=float, nargs="+", default=[8], help="minimum distances between hubs")
+    hubs.add_argument("--binwidth", type=float, default=1)
+    hubs.add_argument("--binheight", type=float, default=1)
+    hubs.add_argument("--iters", type=int, default=5, help="timed runs per experiment")
+    hubs.set_defaults(run=run_hubs, part=PART_1)
+
+    simplify = commands.add_parser("simplify", parents=[common], help="simplify trajectories with TS-greedy (task 2)")
+    simplify.add_argument("--csv", default=data_1)
+    simplify.add_argument("--tids", nargs="+", default=["128-20080503104400"], help="trajectories to simplify")
+    simplify.add_argument("--epsilons", type=float, nargs="+", default=[0.03, 0.1, 0.3])
+    simplify.set_defaults(run=run_simplify, part=PART_1)
+
+    align = commands.add_parser("align", parents=[common], help="compute DTW and Fretchet alignments (task 3)")
+    align.add_argument("--csv", default=data_1)
+    align.add_argument("--pairs", nargs="+", default=ALIGN_PAIRS, metavar="TID", help="trajectory ids, two per pair")
+    align.add_argument("--epsilons", type=float, nargs="+", default=[0], help="0 for the raw trajectories, otherwise the TS-greedy epsilon")
+    align.add_argument("--radii", type=int, nargs="*", default=[], help="FastDTW radii to compare against exact DTW on the raw trajectories")
+    align.set_defaults(run=run_align, part=PART_1)
+
+    center = commands.add_parser("center", parents=[common], help="compute center trajectories (task 4)")
+    center.add_argument("--csv", default=data_2)
+    center.add_argument("--tids", nargs="+", default=CENTER_TIDS, help="trajectories to find the center of")
+    center.add_argument("--epsilons", type=float, nargs="+", default=[0, 0.03, 0.1, 0.3])
+    center.add_argument("--cache", help="sqlite file that keeps DTW distances across runs (default: none)")
+    center.set_defaults(run=run_center, part=PART_2)
+
+    cluster = commands.add_parser("cluster", parents=[common], help="cluster trajectories with Lloyd's algorithm (task 5)")
+    cluster.add_argument("--csv", default=data_2)
+    cluster.add_argument("--epsilon", type=float, default=0.1, help="TS-greedy epsilon applied while reading")
+    cluster.add_argument("--unsorted", action="store_true", help="the rows of a trajectory may be scattered through the file (reads it all into memory)")
+    cluster.add_argument("--k", type=int, default=12, help="number of clusters")
+    cluster.add_argument("--t-max", type=int, default=100, help="maximum iterations of Lloyd's algorithm")
+    cluster.add_argument("--iters", type=int, default=3, help="runs per seeding")
+    cluster.add_argument("--workers", type=int, default=1, help="worker processes of the assignment step, 0 for one per CPU")
+    cluster.add_argument("--batch-size", type=int, default=0, help="trajectories per iteration of mini-batch Lloyd's (default: all, with full Lloyd's)")
+    cluster.add_argument("--nodes", nargs="+", help="shard the trajectories over this many local worker processes, or over the workers at these HOST:PORT addresses")
+    cluster.add_argument("--authkey", help="shared secret of the workers (default: the TRAJECTORY_AUTHKEY environment variable, or a random one for local workers)")
+    cluster.add_argument("--cache", help="sqlite file that keeps DTW distances across runs (default: none)")
+    cluster.set_defaults(run=run_cluster, part=PART_2)
+
+    search = commands.add_parser("search", parents=[common], help="find the trajectories most similar to others in DTW distance")
+    search.add_argument("--csv", default=data_2)
+    search.add_argument("--tids", nargs="+", help="trajectories to query (default: the first --queries trajectories)")
+    search.add_argument("--queries", type=int, default=20, help="number of trajectories to query if --tids is not given")
+    search.add_argument("--k", type=int, default=10, help="number of similar trajectories per query")
+    search.add_argument("--window", type=float, help="Sakoe-Chiba radius of the warping band")
+    search.add_argument("--slope", type=float, help="maximum slope of the Itakura parallelogram")
+    search.set_defaults(run=run_search, part=PART_2)
+
+    return parser, commands.choices
+
+
+def apply_config(parser, subparsers, path):
+    """Uses the options in the JSON file at path as defaults of their commands."""
+    with open(path) as file:
+        config = json.load(file)
+
+    for command, options in config.items():
+        if command not in subparsers:
+            parser.error(f"unknown command {command!r} in {path}")
+        known = {action.dest for action in subparsers[command]._actions}
+        for name in options:
+            if name.replace("-", "_") not in known:
+                parser.error(f"unknown option {name!r} for {command} in {path}")
+        subparsers[command].set_defaults(**{name.replace("-", "_") : value for name, value in options.items()})
+
+
+def main(argv=None):
+    parser, subparsers = build_parser()
+
+    # The config file sets the defaults, so it is read before the other options are parsed
+    config, _ = parser.parse_known_args(argv)
+    if config.config:
+        apply_config(parser, subparsers, config.config)
+    args = parser.parse_args(argv)
+
+    if args.no_plots:
+        os.environ["PLOTS"] = "0"
+
+    # The instrument module of the command's part is the one its modules import
+    instrumented = args.instrument or args.metrics or args.trace
+    if instrumented:
+        use_part(args.part)
+        import instrument
+        instrument.enable()
+
+    args.run(args)
+
+    if not args.no_plots:
+        import plotting
+        plotting.wait()
+
+    if instrumented:
+        print(f"Counters: {instrument.metrics()['counters']}")
+        if args.metrics:
+            instrument.export_metrics(args.metrics)
+        if args.trace:
+            instrument.export_trace(args.trace)
+
+
+if __name__ == "__main__":
+    main()
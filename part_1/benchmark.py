@@ -0,0 +1,55 @@
+import os
+
+from align import get_dtw, get_fretchet
+from bench import main, synthetic_trajectory
+from fretchet import fretchet_kernel
+from hubs import get_hubs, preprocess, read_csv
+from store import load
+from tsgreedy import TSGreedy
+
+# Datasets used by hubs.py, with the parameters of its experiments
+DATASETS = ["geolife-cars-ten-percent", "geolife-cars-thirty-percent", "geolife-cars-sixty-percent", "geolife-cars"]
+BINWIDTH, BINHEIGHT, K, R = 1, 1, 10, 8
+
+
+def cases(rng, lengths, data):
+    """Yields the (name, fn) benchmarks of part 1, on synthetic trajectories and on the geolife datasets."""
+    for n in lengths:
+        P, Q = synthetic_trajectory(rng, n), synthetic_trajectory(rng, n)
+        yield f"get_dtw/synthetic/n={n}", lambda P=P, Q=Q: get_dtw(P, Q)
+        yield f"get_fretchet/synthetic/n={n}", lambda P=P, Q=Q: get_fretchet(P, Q)
+        yield f"fretchet_kernel/synthetic/n={n}", lambda P=P, Q=Q: fretchet_kernel(P, Q)
+        yield f"TSGreedy/synthetic/n={n}", lambda P=P: TSGreedy(P, 0.03)
+
+    points = [tuple(p) for p in rng.normal(50, 10, size=(100000, 2)).clip(0, 100).tolist()]
+    bins = preprocess(points, 100, 100, 0, 0, BINWIDTH, BINHEIGHT)
+    yield "preprocess/synthetic/points=100000", lambda: preprocess(points, 100, 100, 0, 0, BINWIDTH, BINHEIGHT)
+    yield "get_hubs/synthetic/points=100000", lambda: get_hubs(0, 0, bins, BINWIDTH, BINHEIGHT, K, R)
+
+    if not data:
+        return
+
+    for dataset in DATASETS:
+        csv_path = f"./data/{dataset}.csv"
+        if not os.path.exists(csv_path):
+            print(f"Skipping {dataset}: {csv_path} not found")
+            continue
+
+        points, xmax, ymax, xmin, ymin = read_csv(csv_path)
+        bins = preprocess(points, xmax, ymax, xmin, ymin, BINWIDTH, BINHEIGHT)
+        yield f"preprocess/{dataset}", lambda: preprocess(points, xmax, ymax, xmin, ymin, BINWIDTH, BINHEIGHT)
+        yield f"get_hubs/{dataset}", lambda: get_hubs(xmin, ymin, bins, BINWIDTH, BINHEIGHT, K, R)
+
+        # The first two trajectories of the dataset, as they appear in the file
+        store = load(csv_path, 1)
+        tids = list(store.index)[:2]
+        if len(tids) == 2:
+            P, Q = store.tuples(tids[0]), store.tuples(tids[1])
+            yield f"TSGreedy/{dataset}", lambda: TSGreedy(P, 0.03)
+            yield f"get_dtw/{dataset}", lambda: get_dtw(P, Q)
+            yield f"get_fretchet/{dataset}", lambda: get_fretchet(P, Q)
+
+
+if __name__ == "__main__":
+    """Times the kernels of part 1.  Run with --help for the options, e.g. --compare OLD NEW to flag regressions"""
+    main(cases)
@@ -0,0 +1,256 @@
+import numpy as np
+
+import instrument
+
+# Moves recorded for the warping path: the predecessor of each cell
+UP, LEFT, DIAG = 0, 1, 2
+
+# Default radius of fast_dtw, and the length at or below which it aligns trajectories exactly
+RADIUS = 2
+MIN_SIZE = 64
+
+
+def as_array(trajectory):
+    """Returns the trajectory as an (n, 2) array of floats."""
+    return np.asarray(trajectory, dtype=float).reshape(-1, 2)
+
+
+def dtw_kernel(P, Q, path=False, columns=None):
+    """Returns the size-normalised DTW value and warping size of P and Q, plus the warping path if path is True.
+
+    The recurrence is evaluated one anti-diagonal at a time, since every cell on diagonal i + j only
+    depends on the two previous diagonals.  Without the path only three diagonals are kept in memory.
+    columns, a pair of arrays of the first and last column each row may use (monotone, as from
+    project), restricts the evaluation to those cells.
+    """
+    P, Q = as_array(P), as_array(Q)
+    n, m = len(P), len(Q)
+    diagonals = np.arange(n + m - 1)
+    row_lo, row_hi = np.maximum(0, diagonals - m + 1), np.minimum(n - 1, diagonals)
+    if columns is not None:
+        # The rows of a diagonal inside the columns form one range, since i + lo[i] and i + hi[i] increase with i
+        row_lo = np.maximum(row_lo, np.searchsorted(np.arange(n) + columns[1], diagonals))
+        row_hi = np.minimum(row_hi, np.searchsorted(np.arange(n) + columns[0], diagonals, side="right") - 1)
+    row_lo, row_hi = row_lo.tolist(), row_hi.tolist()
+    if instrument.enabled:
+        instrument.count("dtw.calls")
+        instrument.count("dtw.cells", n * m if columns is None else int(np.sum(columns[1] - columns[0] + 1)))
+
+    # Diagonals are stored by row index, shifted by one so that row -1 is a sentinel
+    dtws = [np.full(n + 2, np.inf) for _ in range(3)]
+    sizes = [np.ones(n + 2) for _ in range(3)]
+
+    # The moves of each diagonal, with the row of its first cell
+    moves = [(0, np.array([DIAG], dtype=np.int8))] if path else None
+
+    dtws[0][1] = (P[0, 0] - Q[0, 0])**2 + (P[0, 1] - Q[0, 1])**2
+
+    for k in range(1, n + m - 1):
+        cur, prev, prev2 = k % 3, (k - 1) % 3, (k - 2) % 3
+        lo, hi = row_lo[k], row_hi[k]
+        rows = np.arange(lo, hi + 1)
+        cols = k - rows
+
+        distances = (P[rows, 0] - Q[cols, 0])**2 + (P[rows, 1] - Q[cols, 1])**2
+
+        # Predecessors (i - 1, j), (i, j - 1) and (i - 1, j - 1); out-of-range cells read a sentinel
+        up_size, up_dtw = sizes[prev][lo:hi + 1], dtws[prev][lo:hi + 1]
+        left_size, left_dtw = sizes[prev][lo + 1:hi + 2], dtws[prev][lo + 1:hi + 2]
+        diag_size, diag_dtw = sizes[prev2][lo:hi + 1], dtws[prev2][lo:hi + 1]
+
+        up = (distances + up_size * up_dtw) / (up_size + 1)
+        left = (distances + left_size * left_dtw) / (left_size + 1)
+        diag = (distances + diag_size * diag_dtw) / (diag_size + 1)
+        best = np.minimum(np.minimum(up, left), diag)
+
+        # Ties are broken in the same order as the reference implementation: up, left, then diagonal
+        is_up = up == best
+        is_left = ~is_up & (left == best)
+
+        dtws[cur][lo + 1:hi + 2] = best
+        sizes[cur][lo + 1:hi + 2] = np.where(is_up, up_size, np.where(is_left, left_size, diag_size)) + 1
+        dtws[cur][lo], dtws[cur][hi + 2] = np.inf, np.inf
+        sizes[cur][lo], sizes[cur][hi + 2] = 1, 1
+
+        if path:
+            moves.append((lo, np.where(is_up, UP, np.where(is_left, LEFT, DIAG)).astype(np.int8)))
+
+    last = (n + m - 2) % 3
+    dtw, size = float(dtws[last][n]), int(sizes[last][n])
+
+    if not path:
+        return dtw, size
+
+    return dtw, size, trace_path(moves)
+
+
+def trace_path(moves):
+    """Returns the warping path encoded by moves, the moves of each diagonal with its first row, from the last cell back to (0, 0)."""
+    path = []
+    i = moves[-1][0]
+    j = len(moves) - 1 - i
+    while i > 0 or j > 0:
+        path.append((i, j))
+        first, diagonal = moves[i + j]
+        move = diagonal[i - first]
+        if i == 0:
+            j -= 1
+        elif j == 0:
+            i -= 1
+        elif move == UP:
+            i -= 1
+        elif move == LEFT:
+            j -= 1
+        else:
+            i -= 1
+            j -= 1
+    path.append((0, 0))
+
+    return path
+
+
+def band_kernel(P, Q, columns, path=False):
+    """Returns dtw_kernel(P, Q, path, columns), with the same values and path, for bands only a few cells wide.
+
+    The cells are evaluated one row at a time in plain Python, so the cost is linear in the number of
+    cells in the band.  dtw_kernel pays for a dozen numpy calls on each of the n + m - 1 diagonals however
+    few cells they hold, which dominates in the narrow windows of fast_dtw.  Only two rows are kept in
+    memory, plus the moves of the band if path is True.
+    """
+    P, Q = as_array(P), as_array(Q)
+    n, m = len(P), len(Q)
+    row_lo, row_hi = columns[0].tolist(), columns[1].tolist()
+    Px, Py, Qx, Qy = P[:, 0].tolist(), P[:, 1].tolist(), Q[:, 0].tolist(), Q[:, 1].tolist()
+    if instrument.enabled:
+        instrument.count("dtw.calls")
+        instrument.count("dtw.cells", int(np.sum(columns[1] - columns[0] + 1)))
+
+    inf = float("inf")
+
+    # The previous row, over its columns prev_lo to prev_hi; row -1 has none
+    prev_lo, prev_hi, prev_dtws, prev_sizes = 0, -1, [], []
+    moves = [] if path else None
+
+    for i in range(n):
+        lo, hi = row_lo[i], row_hi[i]
+        x, y = Px[i], Py[i]
+        dtws, sizes = [inf] * (hi - lo + 1), [1] * (hi - lo + 1)
+        row_moves = bytearray(hi - lo + 1) if path else None
+
+        for j in range(lo, hi + 1):
+            # Squared by multiplication, as numpy squares arrays; Python's pow can round differently
+            dx, dy = x - Qx[j], y - Qy[j]
+            distance = dx * dx + dy * dy
+
+            # Predecessors outside the band read the same sentinel as in dtw_kernel
+            up_dtw, up_size = (prev_dtws[j - prev_lo], prev_sizes[j - prev_lo]) if prev_lo <= j <= prev_hi else (inf, 1)
+            left_dtw, left_size = (dtws[j - 1 - lo], sizes[j - 1 - lo]) if j > lo else (inf, 1)
+            diag_dtw, diag_size = (prev_dtws[j - 1 - prev_lo], prev_sizes[j - 1 - prev_lo]) if prev_lo < j <= prev_hi + 1 else (inf, 1)
+
+            up = (distance + up_size * up_dtw) / (up_size + 1)
+            left = (distance + left_size * left_dtw) / (left_size + 1)
+            diag = (distance + diag_size * diag_dtw) / (diag_size + 1)
+            best = min(up, left, diag)
+
+            # Ties are broken in the same order as the reference implementation: up, left, then diagonal
+            if i == 0 and j == 0:
+                best, size, move = distance, 1, DIAG
+            elif up == best:
+                size, move = up_size + 1, UP
+            elif left == best:
+                size, move = left_size + 1, LEFT
+            else:
+                size, move = diag_size + 1, DIAG
+            dtws[j - lo], sizes[j - lo] = best, size
+            if path:
+                row_moves[j - lo] = move
+
+        if path:
+            moves.append((lo, row_moves))
+        prev_lo, prev_hi, prev_dtws, prev_sizes = lo, hi, dtws, sizes
+
+    dtw, size = float(prev_dtws[m - 1 - prev_lo]), int(prev_sizes[m - 1 - prev_lo])
+
+    if not path:
+        return dtw, size
+
+    return dtw, size, trace_rows(moves, m)
+
+
+def trace_rows(moves, m):
+    """Returns the warping path encoded by moves, the moves of each row with its first column, from the last cell back to (0, 0)."""
+    path = []
+    i, j = len(moves) - 1, m - 1
+    while i > 0 or j > 0:
+        path.append((i, j))
+        first, row = moves[i]
+        move = row[j - first]
+        if i == 0:
+            j -= 1
+        elif j == 0:
+            i -= 1
+        elif move == UP:
+            i -= 1
+        elif move == LEFT:
+            j -= 1
+        else:
+            i -= 1
+            j -= 1
+    path.append((0, 0))
+
+    return path
+
+
+def fast_dtw(P, Q, radius=RADIUS, path=False):
+    """Returns an approximation of dtw_kernel(P, Q, path) in time and memory linear in the lengths, for a fixed radius (FastDTW).
+
+    Both trajectories are halved, by averaging consecutive points, until one has at most MIN_SIZE points
+    and is aligned exactly.  The warping path found at each resolution is projected onto the next finer
+    one and widened by radius cells, and band_kernel evaluates the recurrence only in that window.  The
+    result is approximate, above or below dtw_kernel, since the size-normalised recurrence picks each
+    predecessor greedily and the window can change that choice even on the exact path; no radius makes
+    it exact.  On random walks of 300 to 6000 points, radius 1 is typically 1-4% off (at worst 8%) and
+    2-3x faster than dtw_kernel at 300 points, 9-10x at 6000.  Radius 4 is typically 0-2% off (at worst
+    7%) and 1.2-4.5x faster; radius 16 is no faster than exact DTW.  align.compare_fast reports both
+    for a given pair.
+    """
+    P, Q = as_array(P), as_array(Q)
+    n, m = len(P), len(Q)
+    if n <= MIN_SIZE or m <= MIN_SIZE:
+        return dtw_kernel(P, Q, path)
+
+    _, _, coarse_path = fast_dtw(coarsen(P), coarsen(Q), radius, path=True)
+
+    return band_kernel(P, Q, project(coarse_path, n, m, radius), path)
+
+
+def coarsen(P):
+    """Returns P at half the resolution: the mean of each pair of consecutive points, and the last point if n is odd."""
+    half = len(P) // 2
+    coarse = (P[:2 * half:2] + P[1:2 * half:2]) / 2
+    if len(P) % 2:
+        coarse = np.vstack((coarse, P[-1:]))
+
+    return coarse
+
+
+def project(path, n, m, radius):
+    """Returns the first and last column each of n rows may use: the cells of a path at half the resolution, widened by radius cells."""
+    cells = np.array(path)
+
+    # Cell (i, j) of the coarse path covers rows 2i and 2i + 1 and columns 2j and 2j + 1
+    rows = np.minimum(np.concatenate((2 * cells[:, 0], 2 * cells[:, 0] + 1)), n - 1)
+    cols = np.concatenate((2 * cells[:, 1], 2 * cells[:, 1]))
+    lo, hi = np.full(n, m - 1), np.zeros(n, dtype=int)
+    np.minimum.at(lo, rows, cols)
+    np.maximum.at(hi, rows, np.minimum(cols + 1, m - 1))
+
+    # Widens the window by radius rows up and down, then by radius columns
+    wide_lo, wide_hi = lo.copy(), hi.copy()
+    for shift in range(1, min(radius, n - 1) + 1):
+        wide_lo[shift:] = np.minimum(wide_lo[shift:], lo[:-shift])
+        wide_lo[:-shift] = np.minimum(wide_lo[:-shift], lo[shift:])
+        wide_hi[shift:] = np.maximum(wide_hi[shift:], hi[:-shift])
+        wide_hi[:-shift] = np.maximum(wide_hi[:-shift], hi[shift:])
+
+    return np.maximum(wide_lo - radius, 0), np.minimum(wide_hi + radius, m - 1)
@@ -0,0 +1,167 @@
+import numpy as np
+
+import instrument
+from dtw import as_array
+
+# Relative tolerance of squared distances compared to d * d, so that a distance returned by fretchet_kernel
+# is within itself after the rounding of its square root
+SLACK = 1e-12
+
+
+def fretchet_kernel(P, Q, path=False):
+    """Returns the discrete Fretchet distance of P and Q, plus the coupling path if path is True.
+
+    The recurrence runs over squared distances one anti-diagonal at a time, and the square root is only
+    taken at the end.  Without the path the shorter trajectory indexes the diagonals, so memory is
+    linear in min(n, m).
+    """
+    P, Q = as_array(P), as_array(Q)
+    if not path and len(P) > len(Q):
+        P, Q = Q, P
+    n, m = len(P), len(Q)
+    if instrument.enabled:
+        instrument.count("fretchet.calls")
+        instrument.count("fretchet.cells", n * m)
+
+    # Diagonals are stored by row index, shifted by one so that row -1 is a sentinel
+    fretchets = [np.full(n + 2, np.inf) for _ in range(3)]
+    full = np.full((n, m), np.inf) if path else None
+
+    fretchets[0][1] = (P[0, 0] - Q[0, 0])**2 + (P[0, 1] - Q[0, 1])**2
+    if path:
+        full[0, 0] = fretchets[0][1]
+
+    for k in range(1, n + m - 1):
+        cur, prev, prev2 = k % 3, (k - 1) % 3, (k - 2) % 3
+        lo, hi = max(0, k - m + 1), min(n - 1, k)
+        rows = np.arange(lo, hi + 1)
+        cols = k - rows
+
+        distances = (P[rows, 0] - Q[cols, 0])**2 + (P[rows, 1] - Q[cols, 1])**2
+
+        # Predecessors (i - 1, j), (i, j - 1) and (i - 1, j - 1); out-of-range cells read a sentinel
+        reachable = np.minimum(np.minimum(fretchets[prev][lo:hi + 1], fretchets[prev][lo + 1:hi + 2]), fretchets[prev2][lo:hi + 1])
+
+        fretchets[cur][lo + 1:hi + 2] = np.maximum(reachable, distances)
+        fretchets[cur][lo], fretchets[cur][hi + 2] = np.inf, np.inf
+
+        if path:
+            full[rows, cols] = fretchets[cur][lo + 1:hi + 2]
+
+    fretchet = float(fretchets[(n + m - 2) % 3][n])**0.5
+
+    if not path:
+        return fretchet
+
+    return fretchet, trace_path(np.sqrt(full))
+
+
+def trace_path(fretchets):
+    """Returns the coupling path through the matrix of Fretchet values, from the last cell back to (0, 0)."""
+    path = []
+    i, j = fretchets.shape[0] - 1, fretchets.shape[1] - 1
+    while i > 0 or j > 0:
+        path.append((i, j))
+        if i == 0:
+            j -= 1
+        elif j == 0:
+            i -= 1
+        else:
+            best = min(fretchets[i - 1, j - 1], fretchets[i, j - 1], fretchets[i - 1, j])
+            if fretchets[i - 1, j] == best:
+                i -= 1
+            elif fretchets[i, j - 1] == best:
+                j -= 1
+            else:
+                i -= 1
+                j -= 1
+    path.append((0, 0))
+
+    return path
+
+
+def decide(P, Q, d):
+    """Returns whether the discrete Fretchet distance of P and Q is at most d.
+
+    Only the reachable part of the free space is tracked, one row at a time, and the procedure stops as
+    soon as a row has no reachable cell left.
+    """
+    P, Q = as_array(P), as_array(Q)
+    if len(P) < len(Q):
+        P, Q = Q, P
+    m = len(Q)
+    d2 = d * d * (1 + SLACK)
+    if instrument.enabled:
+        instrument.count("fretchet.decide.calls")
+
+    # Every coupling matches the first points and the last points
+    if (P[0, 0] - Q[0, 0])**2 + (P[0, 1] - Q[0, 1])**2 > d2 or (P[-1, 0] - Q[-1, 0])**2 + (P[-1, 1] - Q[-1, 1])**2 > d2:
+        return False
+
+    columns = np.arange(m)
+    reach = np.zeros(m, dtype=bool)
+    for i in range(len(P)):
+        free = (P[i, 0] - Q[:, 0])**2 + (P[i, 1] - Q[:, 1])**2 <= d2
+        if instrument.enabled:
+            instrument.count("fretchet.decide.cells", m)
+
+        # Cells entered from the row below, either straight up or diagonally
+        if i == 0:
+            seeds = columns == 0
+        else:
+            seeds = reach.copy()
+            seeds[1:] |= reach[:-1]
+        seeds &= free
+
+        # A cell is reachable if a seed lies to its left with no blocked cell in between
+        last_seed = np.maximum.accumulate(np.where(seeds, columns, -1))
+        last_block = np.maximum.accumulate(np.where(free, -1, columns))
+        reach = last_seed > last_block
+
+        if not reach.any():
+            return False
+
+    return bool(reach[-1])
+
+
+def range_query(Q, trajectories, d):
+    """Returns the ids of the trajectories whose discrete Fretchet distance to Q is at most d."""
+    Q = as_array(Q)
+    Qmin, Qmax = Q.min(axis=0), Q.max(axis=0)
+    d2 = d * d * (1 + SLACK)
+
+    matches = []
+    for tid, P in trajectories.items():
+        P = as_array(P)
+
+        # Endpoints are always matched to each other
+        if ((P[0] - Q[0])**2).sum() > d2 or ((P[-1] - Q[-1])**2).sum() > d2:
+            continue
+
+        # Every point must be within d of the other trajectory, and so of its bounding box
+        Pmin, Pmax = P.min(axis=0), P.max(axis=0)
+        if (((np.maximum(Qmin - P, 0) + np.maximum(P - Qmax, 0))**2).sum(axis=1) > d2).any():
+            continue
+        if (((np.maximum(Pmin - Q, 0) + np.maximum(Q - Pmax, 0))**2).sum(axis=1) > d2).any():
+            continue
+
+        if decide(P, Q, d):
+            matches.append(tid)
+
+    return matches
+
+
+if __name__ == "__main__":
+    """Checks on random trajectories that decide and range_query accept the distance computed by fretchet_kernel"""
+    TRIALS = 1000
+    rng = np.random.default_rng(0)
+
+    for _ in range(TRIALS):
+        P = rng.normal(size=(int(rng.integers(1, 30)), 2)).cumsum(axis=0)
+        Q = rng.normal(size=(int(rng.integers(1, 30)), 2)).cumsum(axis=0)
+        d = fretchet_kernel(P, Q)
+
+        assert decide(P, Q, d), f"decide rejects the Fretchet distance {d}"
+        assert range_query(Q, {"P": P}, d) == ["P"], f"range_query misses a match at the Fretchet distance {d}"
+
+    print(f"decide and range_query agree with fretchet_kernel on {TRIALS} random pairs")
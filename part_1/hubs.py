@@ -1,108 +1,170 @@
 import os
-import csv
 import sys
 import math
 import time
-import matplotlib.pyplot as plt
-import matplotlib.patches as ptc
+import numpy as np
+import instrument
+import plotting
+from store import load
+from stream import point_chunks
+
+# Above this many points, plot draws a density image of DENSITY_BINS x DENSITY_BINS cells instead of a scatter plot
+MAX_SCATTER = 200000
+DENSITY_BINS = 1000
 
 def read_csv(csv_path):
     """Returns the list of points and their x and y boundaries."""
-    points = []
-    xmax = 0
-    ymax = 0
-    xmin = sys.maxsize
-    ymin = sys.maxsize
-
-    with open(csv_path) as file:
-        reader = csv.reader(file, delimiter=",")
-
-        next(file)
-        for row in reader:
-            points.append((float(row[2]), float(row[3])))
-            xmax = max(xmax, float(row[2]))
-            ymax = max(ymax, float(row[3]))
-            xmin = min(xmin, float(row[2]))
-            ymin = min(ymin, float(row[3]))
-
-    xmax = math.ceil(xmax)
-    ymax = math.ceil(ymax)
-    xmin = math.floor(xmin)
-    ymin = math.floor(ymin)
+    store = load(csv_path, 1)
+    points = list(zip(store.x.tolist(), store.y.tolist()))
+
+    # The running maximum starts from 0 and the running minimum from sys.maxsize
+    xmax = math.ceil(store.x.max(initial = 0))
+    ymax = math.ceil(store.y.max(initial = 0))
+    xmin = math.floor(store.x.min(initial = sys.maxsize))
+    ymin = math.floor(store.y.min(initial = sys.maxsize))
 
     return points, xmax, ymax, xmin, ymin
 
 def preprocess(points, xmax, ymax, xmin, ymin, binwidth, binheight):
-    """Inserts each point into rectangular bins of width binwidth and height binheight.  Returns the rectangular bins sorted by density."""
+    """Inserts each point into rectangular bins of width binwidth and height binheight.  Returns the rectangular bins sorted by density.
+
+    Only bins with at least one point in their 3x3 neighbourhood are kept, so memory grows with the number
+    of points rather than with the area of the bounding box.  Ties in density keep the (xbin, ybin) order.
+    """
+    with instrument.span("hubs.preprocess", points = len(points)):
+        occupied, counts = count_bins(points, xmax, ymax, xmin, ymin, binwidth, binheight)
+        bins = sort_bins(occupied, counts, xmax, ymax, xmin, ymin, binwidth, binheight)
+
+    return bins
+
+def count_bins(points, xmax, ymax, xmin, ymin, binwidth, binheight):
+    """Returns the sorted ids (xbin * ybins + ybin) of the bins that contain points, and their number of points."""
     xbins = math.ceil((xmax - xmin)/binwidth)
     ybins = math.ceil((ymax - ymin)/binheight)
 
-    bins = {}
-    for xbin in range(xbins):
-        for ybin in range(ybins):
-            bins[(xbin, ybin)] = 0
+    points = np.asarray(points, dtype = float).reshape(-1, 2)
+
+    # Points on the upper boundary belong to the last bin
+    xbin = np.clip((points[:, 0] - xmin)//binwidth, 0, xbins - 1).astype(np.int64)
+    ybin = np.clip((points[:, 1] - ymin)//binheight, 0, ybins - 1).astype(np.int64)
 
-    for point in points:
-        xbin = (point[0] - xmin)//binwidth
-        ybin = (point[1] - ymin)//binheight
-        bins[(xbin, ybin)] += 1   
+    return np.unique(xbin * ybins + ybin, return_counts = True)
+
+def sort_bins(occupied, counts, xmax, ymax, xmin, ymin, binwidth, binheight):
+    """Returns the bins with a non-zero density, mapped to their number of points and sorted by density."""
+    xbins = math.ceil((xmax - xmin)/binwidth)
+    ybins = math.ceil((ymax - ymin)/binheight)
+
+    if len(occupied) == 0:
+        return {}
+
+    # Candidate bins are the occupied bins and their neighbours inside the grid
+    offsets = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+    xocc, yocc = occupied // ybins, occupied % ybins
+    candidates = []
+    for dx, dy in offsets:
+        inside = (xocc + dx >= 0) & (xocc + dx < xbins) & (yocc + dy >= 0) & (yocc + dy < ybins)
+        candidates.append(occupied[inside] + dx * ybins + dy)
+    candidates = np.unique(np.concatenate(candidates))
+
+    # Sums the occupied bins in each candidate's neighbourhood, looking them up in the sorted occupied bins
+    xcand, ycand = candidates // ybins, candidates % ybins
+    densities = np.zeros(len(candidates), dtype = np.int64)
+    bin_counts = np.zeros(len(candidates), dtype = np.int64)
+    for dx, dy in offsets:
+        inside = (xcand + dx >= 0) & (xcand + dx < xbins) & (ycand + dy >= 0) & (ycand + dy < ybins)
+        neighbours = candidates + dx * ybins + dy
+        position = np.minimum(np.searchsorted(occupied, neighbours), len(occupied) - 1)
+        found = inside & (occupied[position] == neighbours)
+        densities += np.where(found, counts[position], 0)
+        if dx == 0 and dy == 0:
+            bin_counts = np.where(found, counts[position], 0)
 
     # Sorts the bins by density
-    bins = dict(sorted(bins.items(), key = lambda item: get_density(((item[0][0] + 0.5) * binwidth + xmin, (item[0][1] + 0.5) * binheight + ymin), xmin, ymin, xbins, ybins, bins, binwidth, binheight), reverse = True))
+    order = np.lexsort((candidates, -densities))
+    bins = {(int(xcand[i]), int(ycand[i])) : int(bin_counts[i]) for i in order}
 
     return bins
 
-def get_density(point, xmin, ymin, xbins, ybins, bins, binwidth, binheight):
-    """Returns the sum of the points within a bin and its 8 surrounding bins"""
-    xpoint, ypoint = point
-    xbin, ybin = (xpoint - xmin)//binwidth, (ypoint - ymin)//binheight
+def preprocess_stream(csv_path, binwidth, binheight):
+    """Bins the points of the csv file chunk by chunk, without holding them in memory.  Returns the bins sorted by density and the x and y boundaries.
 
-    density = 0
-    # Adds the number of points in the bin that contains the point with the number of points in the surrounding 8 bins
-    for x in range(int(max(0, xbin - 1)), int(min(xbins, xbin + 2))):
-        for y in range(int(max(0, ybin - 1)), int(min(ybins, ybin + 2))):
-            density += bins[(x, y)]
+    The file is read twice: once to accumulate the boundaries and once to accumulate the bin counts.
+    """
+    xmax, ymax, xmin, ymin = 0, 0, sys.maxsize, sys.maxsize
+    for _, points in point_chunks(csv_path, 1):
+        xmax, ymax = max(xmax, points[:, 0].max()), max(ymax, points[:, 1].max())
+        xmin, ymin = min(xmin, points[:, 0].min()), min(ymin, points[:, 1].min())
+    xmax, ymax, xmin, ymin = math.ceil(xmax), math.ceil(ymax), math.floor(xmin), math.floor(ymin)
 
-    return density
+    occupied, counts = np.empty(0, dtype = np.int64), np.empty(0, dtype = np.int64)
+    for _, points in point_chunks(csv_path, 1):
+        chunk_occupied, chunk_counts = count_bins(points, xmax, ymax, xmin, ymin, binwidth, binheight)
 
-def get_hubs(xmin, ymin, bins, binwidth, binheight, k, r):
-    """Iterates through the sorted bins, adding the middle of each bin to a list of hubs if it is at least r away from existing hubs.  Returns a list of k hubs."""
-    hubs = []
+        # Merges the chunk's counts into the running counts
+        occupied, inverse = np.unique(np.concatenate((occupied, chunk_occupied)), return_inverse = True)
+        counts = np.bincount(inverse.reshape(-1), weights = np.concatenate((counts, chunk_counts)), minlength = len(occupied)).astype(np.int64)
 
-    for bin in bins.keys():
-        xbin, ybin = bin
-        hub = (xbin + 0.5) * binwidth + xmin, (ybin + 0.5) * binheight + ymin
+    bins = sort_bins(occupied, counts, xmax, ymax, xmin, ymin, binwidth, binheight)
 
-        # Check if the candidate hub is at least r away from all selected hubs
-        if all(distance(hub, p) >= r for p in hubs):
-            hubs.append(hub)
+    return bins, xmax, ymax, xmin, ymin
 
-        if len(hubs) == k:
-            return hubs
+def get_hubs(xmin, ymin, bins, binwidth, binheight, k, r):
+    """Iterates through the sorted bins, adding the middle of each bin to a list of hubs if it is at least r away from existing hubs.  Returns a list of k hubs.
+
+    Only bins near a point are candidates, so if fewer than k of them are at least r apart, fewer than k hubs
+    are returned; empty regions of the bounding box are never hubs.
+    """
+    with instrument.span("hubs.get_hubs", k = k, r = r):
+        hubs = []
+
+        # Selected hubs are indexed by a grid of r x r cells, so any hub closer than r lies in one of the 9 cells around a candidate
+        grid = {}
+
+        for bin in bins:
+            xbin, ybin = bin
+            hub = (xbin + 0.5) * binwidth + xmin, (ybin + 0.5) * binheight + ymin
+
+            # Check if the candidate hub is at least r away from all selected hubs
+            if r <= 0:
+                hubs.append(hub)
+            else:
+                xcell, ycell = math.floor(hub[0] / r), math.floor(hub[1] / r)
+                neighbours = (p for x in range(xcell - 1, xcell + 2) for y in range(ycell - 1, ycell + 2) for p in grid.get((x, y), ()))
+                if all(distance(hub, p) >= r for p in neighbours):
+                    hubs.append(hub)
+                    grid.setdefault((xcell, ycell), []).append(hub)
+
+            if len(hubs) == k:
+                return hubs
         
-    return hubs
+        return hubs
 
 def distance(p, q):
     """Returns the Euclidean distance between p and q."""
     return ((p[0] - q[0])**2 + (p[1] - q[1])**2)**0.5
 
 def plot(fig_path, points, hubs, r):
-    """Generates and saves a visualization of points and hubs."""
-    xpoints = []
-    ypoints = []
+    """Generates and saves a visualization of points and hubs.  Above MAX_SCATTER points, the points are drawn as a density image instead of one marker each."""
+    # Imported here so that compute-only runs never load matplotlib
+    import matplotlib.pyplot as plt
+    import matplotlib.patches as ptc
+
+    points = np.asarray(points, dtype = float).reshape(-1, 2)
     xhubs = []
     yhubs = []
     
-    for point in points:
-        xpoints.append(point[0])
-        ypoints.append(point[1])
     for hub in hubs:
         xhubs.append(hub[0])
         yhubs.append(hub[1])
     
     fig, ax = plt.subplots()
     ax.set_aspect("equal")
-    ax.scatter(xpoints, ypoints, marker = ".", s = 1, c = "b", alpha = 0.1, label = "Points")
+    if len(points) > MAX_SCATTER:
+        counts, xedges, yedges = np.histogram2d(points[:, 0], points[:, 1], bins = DENSITY_BINS)
+        ax.imshow(np.log1p(counts.T), origin = "lower", extent = (xedges[0], xedges[-1], yedges[0], yedges[-1]), cmap = "Blues")
+    else:
+        ax.scatter(points[:, 0], points[:, 1], marker = ".", s = 1, c = "b", alpha = 0.1, label = "Points")
     ax.scatter(xhubs, yhubs, marker = "s", s = 2, c = "r", label = "Hubs")
     ax.legend()
 
@@ -111,18 +173,33 @@ def plot(fig_path, points, hubs, r):
         ax.add_patch(circle)
 
     fig.savefig(fig_path, dpi = 500)
+    plt.close(fig)
     
-def experiment(csv_path, fig_path, binwidth, binheight, k, r):
-    """Runs an experiment with given input variables.  Returns the runtime of preprocessing and getting hubs."""
+def experiment(csv_path, fig_path, binwidth, binheight, k, r, render = True):
+    """Runs an experiment with given input variables.  Returns the runtime of preprocessing and getting hubs.  The figure is rendered in the background, and only if render is True."""
     points, xmax, ymax, xmin, ymin = read_csv(csv_path)
     start = time.time()
     bins = preprocess(points, xmax, ymax, xmin, ymin, binwidth, binheight)
     hubs = get_hubs(xmin, ymin, bins, binwidth, binheight, k, r)
     runtime = time.time() - start
-    plot(fig_path, points, hubs, r)
+    if len(hubs) < k:
+        print(f"Only {len(hubs)} of {k} hubs are at least {r} apart in bins near a point")
+    if render:
+        plotting.submit(plot, fig_path, np.asarray(points), hubs, r)
 
     return runtime
 
+def timing(csv_path, fig_path, binwidth, binheight, k, r, iters):
+    """Runs an experiment iters times and prints each runtime.  Returns the average runtime.  Only the first run is plotted."""
+    total = 0
+    for iter in range(iters):
+        runtime = experiment(csv_path, fig_path, binwidth, binheight, k, r, render = iter == 0)
+        print(runtime)
+        total += runtime
+    print(f"Average runtime over {iters} iterations: {total/iters}")
+
+    return total/iters
+
 if __name__ == "__main__":
     """Runs the list of experiments designated in the case study description"""
     csv_path = "./data/geolife-cars.csv"
@@ -131,10 +208,7 @@ if __name__ == "__main__":
     binheight = 1
     iters = 5
 
-    if not os.path.exists("./figures"):
-        os.mkdir("./figures")
-    if not os.path.exists("./figures/task_1"):
-        os.mkdir("./figures/task_1")
+    os.makedirs("./figures/task_1", exist_ok = True)
 
     experiment(csv_path, "./figures/task_1/geolife-cars_10_8.png", binwidth, binheight, 10, 8)
 
@@ -142,19 +216,11 @@ if __name__ == "__main__":
     for k in [5, 10, 20, 40]:
         print(f"geolife-cars, k = {k}, r = 2:")
         print("-----------------------------")
-        total = 0
-        for iter in range(iters):
-            runtime = experiment(csv_path, f"./figures/task_1/geolife-cars_{k}_2.png", binwidth, binheight, k, 2)
-            print(runtime)
-            total += runtime
-        print(f"Average runtime over {iters} iterations: {total/iters}")
+        timing(csv_path, f"./figures/task_1/geolife-cars_{k}_2.png", binwidth, binheight, k, 2, iters)
         
     for path in ["geolife-cars-ten-percent", "geolife-cars-thirty-percent", "geolife-cars-sixty-percent", "geolife-cars"]:
         print(f"{path}, k = 10, r = 8:")
         print("-----------------------------")
-        total = 0
-        for iter in range(iters):
-            runtime = experiment(f"data/{path}.csv", f"./figures/task_1/{path}_10_8.png", binwidth, binheight, 10, 8)
-            print(runtime)
-            total += runtime
-        print(f"Average runtime over {iters} iterations: {total/iters}")
\ No newline at end of file
+        timing(f"data/{path}.csv", f"./figures/task_1/{path}_10_8.png", binwidth, binheight, 10, 8, iters)
+
+    plotting.wait()
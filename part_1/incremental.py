@@ -0,0 +1,101 @@
+import math
+import heapq
+from collections import deque
+
+from hubs import count_bins, get_hubs
+
+# Offsets of a bin and its 8 surrounding bins
+NEIGHBOURS = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+
+
+class IncrementalHubs:
+    """Keeps the top-k hubs of a stream of point batches up to date, on the bin grid that preprocess would use.
+
+    Bin counts and neighbourhood densities are updated in place as batches are added or expired.  The hubs
+    are only selected again when a bin whose density changed is, or becomes, part of the density-ordered
+    prefix that the last selection scanned, since the selection only depends on that prefix.
+    """
+
+    def __init__(self, xmax, ymax, xmin, ymin, binwidth, binheight, k, r):
+        self.bounds = (xmax, ymax, xmin, ymin)
+        self.binwidth, self.binheight = binwidth, binheight
+        self.k, self.r = k, r
+        self.ybins = math.ceil((ymax - ymin)/binheight)
+        self.xbins = math.ceil((xmax - xmin)/binwidth)
+
+        # Bin ids are xbin * ybins + ybin; only non-zero counts and densities are stored
+        self.counts = {}
+        self.densities = {}
+        self.batches = deque()
+
+        # Last selection, and the (-density, bin id) key of the last bin it scanned (None if it scanned every bin)
+        self._hubs = None
+        self._frontier = None
+        self.recomputes = 0
+
+    def add(self, points, timestamp=None):
+        """Adds a batch of points, optionally tagged with a timestamp for expire."""
+        xmax, ymax, xmin, ymin = self.bounds
+        occupied, counts = count_bins(points, xmax, ymax, xmin, ymin, self.binwidth, self.binheight)
+        self.batches.append((timestamp, occupied, counts))
+        self._update(occupied.tolist(), counts.tolist())
+
+    def expire(self, before):
+        """Removes the oldest batches whose timestamp is earlier than before, e.g. to keep a sliding time window."""
+        while self.batches and self.batches[0][0] is not None and self.batches[0][0] < before:
+            _, occupied, counts = self.batches.popleft()
+            self._update(occupied.tolist(), (-counts).tolist())
+
+    def hubs(self):
+        """Returns the current list of at most k hubs, as get_hubs would select them from all current points."""
+        if self._hubs is None:
+            self._select()
+
+        return list(self._hubs)
+
+    def _update(self, occupied, counts):
+        old_densities = {}
+
+        for bin, count in zip(occupied, counts):
+            self._add_to(self.counts, bin, count)
+
+            xbin, ybin = divmod(bin, self.ybins)
+            for dx, dy in NEIGHBOURS:
+                if 0 <= xbin + dx < self.xbins and 0 <= ybin + dy < self.ybins:
+                    neighbour = bin + dx * self.ybins + dy
+                    old_densities.setdefault(neighbour, self.densities.get(neighbour, 0))
+                    self._add_to(self.densities, neighbour, count)
+
+        if self._hubs is not None and any(self._in_prefix(bin, density) or self._in_prefix(bin, self.densities.get(bin, 0)) for bin, density in old_densities.items()):
+            self._hubs = None
+
+    def _in_prefix(self, bin, density):
+        """Returns whether a bin with this density is part of the prefix scanned by the last selection."""
+        if density == 0:
+            return False
+
+        return self._frontier is None or (-density, bin) <= self._frontier
+
+    def _select(self):
+        heap = [(-density, bin) for bin, density in self.densities.items()]
+        heapq.heapify(heap)
+
+        # Bins are produced lazily in the order of sort_bins, so only the scanned prefix is sorted
+        def ordered_bins():
+            while heap:
+                self._frontier = heapq.heappop(heap)
+                yield divmod(self._frontier[1], self.ybins)
+
+        xmin, ymin = self.bounds[2], self.bounds[3]
+        self._hubs = get_hubs(xmin, ymin, ordered_bins(), self.binwidth, self.binheight, self.k, self.r)
+        if len(self._hubs) < self.k:
+            self._frontier = None
+        self.recomputes += 1
+
+    @staticmethod
+    def _add_to(values, key, amount):
+        value = values.get(key, 0) + amount
+        if value:
+            values[key] = value
+        else:
+            del values[key]
@@ -0,0 +1,52 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# Figures are rendered unless disabled here or with the environment variable PLOTS=0
+enabled = os.environ.get("PLOTS", "1") != "0"
+
+# Number of background processes that render figures
+WORKERS = 2
+
+_pool = None
+_pending = []
+
+
+def disable():
+    """Skips all plotting, e.g. for benchmark-only runs."""
+    global enabled
+    enabled = False
+
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use("Agg")
+
+
+def submit(plot_fn, *args, **kwargs):
+    """Renders plot_fn(*args, **kwargs) in a background process, so the caller can carry on computing.
+
+    plot_fn must be a module-level function, and its arguments are sent to the worker, so large point sets
+    should be passed as arrays.  Returns the future, or None if plotting is disabled.
+    """
+    global _pool
+    if not enabled:
+        return None
+
+    if _pool is None:
+        _pool = ProcessPoolExecutor(WORKERS, initializer=_init_worker)
+    future = _pool.submit(plot_fn, *args, **kwargs)
+    _pending.append(future)
+
+    return future
+
+
+def wait():
+    """Waits for every submitted figure to be saved, raising the first rendering error, and stops the workers."""
+    global _pool
+    try:
+        while _pending:
+            _pending.pop(0).result()
+    finally:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
@@ -0,0 +1,173 @@
+import os
+import mmap
+import struct
+import numpy as np
+
+from stream import point_chunks
+
+# Binary layout: header, trajectory offsets, trajectory lengths, fixed-width ids, padding to 8 bytes, then the (N, 2) points
+MAGIC = b"TRJS"
+VERSION = 1
+HEADER = struct.Struct("<4sIIIQQ")
+
+# Stores that have already been parsed, keyed by path and id column
+_stores = {}
+
+
+class TrajectoryStore:
+    """Points of every trajectory in one contiguous (N, 2) array, with an index from trajectory id to (offset, length).
+
+    Points of the same trajectory are kept together and in file order, and trajectories are ordered by
+    their first appearance in the file, so a lookup is a slice of the array rather than a scan of the file.
+    """
+
+    def __init__(self, points, index):
+        self.points = points
+        self.index = index
+
+    @property
+    def x(self):
+        return self.points[:, 0]
+
+    @property
+    def y(self):
+        return self.points[:, 1]
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, tid):
+        return tid in self.index
+
+    def __getitem__(self, tid):
+        """Returns the points of trajectory tid as an (n, 2) view of the store."""
+        offset, length = self.index[tid]
+        return self.points[offset:offset + length]
+
+    def tuples(self, tid):
+        """Returns the points of trajectory tid as a list of (x, y) tuples."""
+        if tid not in self.index:
+            return []
+        trajectory = self[tid]
+        return list(zip(trajectory[:, 0].tolist(), trajectory[:, 1].tolist()))
+
+
+def parse_csv(csv_path, tid_column=0):
+    """Returns a TrajectoryStore of the csv file whose trajectory id is in column tid_column, followed by x and y.
+
+    The file is read in chunks, each converted to arrays of points and trajectory numbers before the next
+    is read, so the rows are never all held as Python objects.
+    """
+    numbers = {}
+    point_arrays, code_arrays = [], []
+    for tids, points in point_chunks(csv_path, tid_column):
+        # Numbers trajectories by first appearance in the file
+        names, first, inverse = np.unique(tids, return_index=True, return_inverse=True)
+        for i in np.argsort(first).tolist():
+            numbers.setdefault(str(names[i]), len(numbers))
+
+        code_arrays.append(np.array([numbers[str(name)] for name in names], dtype=np.int64)[inverse.reshape(-1)])
+        point_arrays.append(points)
+
+    if not numbers:
+        return TrajectoryStore(np.empty((0, 2)), {})
+
+    # Groups the points of each trajectory with a stable sort
+    codes = np.concatenate(code_arrays)
+    order = np.argsort(codes, kind="stable")
+    points = np.concatenate(point_arrays)[order]
+
+    lengths = np.bincount(codes, minlength=len(numbers))
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    index = {tid : (int(offsets[r]), int(lengths[r])) for tid, r in numbers.items()}
+
+    return TrajectoryStore(points, index)
+
+
+def binary_path(csv_path):
+    """Returns the path of the binary copy of the csv file."""
+    return os.path.splitext(csv_path)[0] + ".trj"
+
+
+def write_binary(store, path, tid_column=0):
+    """Writes the store to path in the packed binary format."""
+    tids = list(store.index.keys())
+    ids = np.array([tid.encode() for tid in tids], dtype=bytes)
+    width = ids.dtype.itemsize if len(ids) else 1
+    offsets = np.array([store.index[tid][0] for tid in tids], dtype="<i8")
+    lengths = np.array([store.index[tid][1] for tid in tids], dtype="<i8")
+
+    # Writes to a temporary file first so an interrupted run never leaves a truncated copy behind
+    with open(path + ".tmp", "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, tid_column, width, len(tids), len(store.points)))
+        file.write(offsets.tobytes())
+        file.write(lengths.tobytes())
+        file.write(ids.astype(f"S{width}").tobytes())
+        file.write(b"\0" * (-file.tell() % 8))
+        file.write(np.ascontiguousarray(store.points, dtype="<f8").tobytes())
+    os.replace(path + ".tmp", path)
+
+
+def open_binary(path, tid_column=0):
+    """Returns a TrajectoryStore whose points are memory-mapped from the binary file, or None if the file cannot be used.
+
+    Only the header and the index are read up front; the coordinates of a trajectory are paged in when
+    it is first accessed.
+    """
+    with open(path, "rb") as file:
+        file_size = os.fstat(file.fileno()).st_size
+        if file_size < HEADER.size:
+            return None
+
+        magic, version, column, width, count, size = HEADER.unpack(file.read(HEADER.size))
+        if magic != MAGIC or version != VERSION or column != tid_column:
+            return None
+
+        # A truncated or partly written file does not hold every record the header announces
+        index_size = HEADER.size + (16 + width) * count
+        if file_size != index_size + (-index_size % 8) + 16 * size:
+            return None
+
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    position = HEADER.size
+    offsets = np.frombuffer(buffer, dtype="<i8", count=count, offset=position)
+    position += 8 * count
+    lengths = np.frombuffer(buffer, dtype="<i8", count=count, offset=position)
+    position += 8 * count
+    ids = np.frombuffer(buffer, dtype=f"S{width}", count=count, offset=position)
+    position += width * count
+    position += -position % 8
+    points = np.frombuffer(buffer, dtype="<f8", count=2 * size, offset=position).reshape(size, 2)
+
+    index = {tid.decode() : (int(offset), int(length)) for tid, offset, length in zip(ids, offsets, lengths)}
+
+    return TrajectoryStore(points, index)
+
+
+def load(csv_path, tid_column=0):
+    """Returns the TrajectoryStore of the csv file, parsing it only the first time it is requested.
+
+    The first parse also writes a binary copy next to the csv file, which later processes memory-map
+    instead of parsing the csv again.
+    """
+    key = (os.path.abspath(csv_path), tid_column)
+    mtime = os.path.getmtime(csv_path)
+
+    if key not in _stores or _stores[key][0] != mtime:
+        path = binary_path(csv_path)
+        store = None
+        if os.path.exists(path) and os.path.getmtime(path) >= mtime:
+            store = open_binary(path, tid_column)
+
+        if store is None:
+            store = parse_csv(csv_path, tid_column)
+            try:
+                write_binary(store, path, tid_column)
+            except OSError:
+                # The binary copy is only an optimization, e.g. the data directory may be read-only
+                pass
+
+        _stores[key] = (mtime, store)
+
+    return _stores[key][1]
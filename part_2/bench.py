@@ -0,0 +1,108 @@
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+import numpy as np
+
+# Relative slowdown of the median above which compare reports a regression
+THRESHOLD = 0.1
+
+
+def measure(fn, warmup=1, repeat=5):
+    """Returns timing statistics, in seconds, of repeat calls to fn after warmup untimed calls."""
+    for _ in range(warmup):
+        fn()
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.mean(times),
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "times": times,
+    }
+
+
+def synthetic_trajectory(rng, length, step=0.01):
+    """Returns a random walk of length points as a list of (x, y) tuples."""
+    steps = rng.normal(0, step, size=(length, 2)).cumsum(axis=0)
+    return list(zip(steps[:, 0].tolist(), steps[:, 1].tolist()))
+
+
+def environment():
+    """Returns the versions and machine the benchmarks ran on."""
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+    }
+
+
+def run(cases, settings):
+    """Times every (name, fn) of cases and returns the results to be saved as JSON."""
+    results = {}
+    for name, fn in cases:
+        # Every case starts from the same random state, so runs are reproducible
+        random.seed(settings["seed"])
+        results[name] = measure(fn, settings["warmup"], settings["repeat"])
+        print(f"{name}: median {results[name]['median']:.6f}s over {settings['repeat']} runs")
+
+    return {"environment": environment(), "settings": settings, "results": results}
+
+
+def compare(old, new, threshold=THRESHOLD):
+    """Prints the change of every benchmark present in both runs.  Returns the names whose median slowed down by more than threshold."""
+    regressions = []
+    for name in old["results"]:
+        if name not in new["results"]:
+            continue
+
+        before, after = old["results"][name]["median"], new["results"][name]["median"]
+        ratio = after / before if before > 0 else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name}: {before:.6f}s -> {after:.6f}s ({ratio:.2f}x){flag}")
+
+    return regressions
+
+
+def main(make_cases, argv=None):
+    """Command-line entry point shared by the benchmark modules.  make_cases(rng, lengths, data) returns the (name, fn) cases."""
+    parser = argparse.ArgumentParser(description="Runs the benchmarks, or compares two saved runs.")
+    parser.add_argument("--output", default="benchmark.json", help="where to save the results")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per benchmark")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed runs per benchmark")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic data and of random")
+    parser.add_argument("--lengths", type=int, nargs="+", default=[50, 200, 1000], help="lengths of the synthetic trajectories")
+    parser.add_argument("--no-data", action="store_true", help="skip the benchmarks on the geolife datasets")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two saved runs instead of running")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="relative slowdown reported as a regression")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as file:
+            old = json.load(file)
+        with open(args.compare[1]) as file:
+            new = json.load(file)
+        regressions = compare(old, new, args.threshold)
+        print(f"{len(regressions)} regression(s)")
+        sys.exit(1 if regressions else 0)
+
+    settings = {"repeat": args.repeat, "warmup": args.warmup, "seed": args.seed, "lengths": args.lengths, "data": not args.no_data}
+    rng = np.random.default_rng(args.seed)
+    results = run(make_cases(rng, args.lengths, settings["data"]), settings)
+
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"Results saved to {args.output}")
@@ -0,0 +1,86 @@
+import os
+
+from bench import main, synthetic_trajectory
+from center import approach_1, approach_2
+from cluster import lloyds, random_seed
+from dtw import RADIUS
+from search import SimilarityIndex
+from utils import dtw_distance, dtw_distances, read_csv, ts_greedy
+
+# Dataset used by center.py and cluster.py
+CSV_PATH = "./data/geolife-cars-upd8.csv"
+
+# Number of trajectories of the center benchmarks, as in center.py, and of the clustering benchmark
+CENTER_SIZE = 11
+CLUSTER_SIZE = 100
+K = 12
+
+# Number of top-k queries of the search benchmark, and k
+QUERIES = 10
+TOP_K = 10
+
+# Shares of the geolife trajectories, in file order, that the clustering benchmarks run on, like the
+# ten, thirty and sixty percent datasets of part 1
+SUBSETS = {"ten-percent": 0.1, "thirty-percent": 0.3, "sixty-percent": 0.6, "full": 1.0}
+
+
+def center_cases(label, trajectories):
+    """Yields the center benchmarks over the first CENTER_SIZE of the given trajectories."""
+    members = dict(list(trajectories.items())[:CENTER_SIZE])
+    yield f"approach_1/{label}", lambda: approach_1(members, workers = 1)
+    yield f"approach_2/{label}", lambda: approach_2(members)
+
+
+def clustering_cases(label, collection):
+    """Yields the clustering and search benchmarks over the given collection of trajectories."""
+    # One iteration of Lloyd's algorithm, seeded by the benchmark seed
+    k = min(K, len(collection))
+    yield f"lloyds_iteration/{label}", lambda: lloyds(collection, random_seed, k, 1)
+
+    # Top-k queries of the first trajectories against the collection, excluding themselves
+    index = SimilarityIndex(collection)
+    queries = dict(list(collection.items())[:QUERIES])
+    yield f"search_top{TOP_K}/{label}", lambda: index.search(queries, TOP_K)
+
+
+def cases(rng, lengths, data):
+    """Yields the (name, fn) benchmarks of part 2, on synthetic trajectories and on the geolife dataset."""
+    for n in lengths:
+        P, Q = synthetic_trajectory(rng, n), synthetic_trajectory(rng, n)
+        yield f"dtw_distance/synthetic/n={n}", lambda P=P, Q=Q: dtw_distance(P, Q)
+        yield f"fast_dtw_distance/synthetic/n={n}", lambda P=P, Q=Q: dtw_distance(P, Q, radius = RADIUS)
+        yield f"ts_greedy/synthetic/n={n}", lambda P=P: ts_greedy(P, 0.03)
+
+        # One trajectory against K centers, as in the assignment step
+        centers = [synthetic_trajectory(rng, n) for _ in range(K)]
+        yield f"dtw_distances/synthetic/n={n}/k={K}", lambda P=P, centers=centers: dtw_distances(P, centers)
+
+    for n in lengths:
+        trajectories = {str(i) : synthetic_trajectory(rng, n) for i in range(CLUSTER_SIZE)}
+        yield from center_cases(f"synthetic/n={n}", trajectories)
+        yield from clustering_cases(f"synthetic/n={n}", trajectories)
+
+    if not data:
+        return
+
+    if not os.path.exists(CSV_PATH):
+        print(f"Skipping the geolife benchmarks: {CSV_PATH} not found")
+        return
+
+    trajectories = read_csv(CSV_PATH)
+    tids = list(trajectories)[:2]
+    if len(tids) == 2:
+        P, Q = trajectories[tids[0]], trajectories[tids[1]]
+        yield "dtw_distance/geolife", lambda: dtw_distance(P, Q)
+        yield "ts_greedy/geolife", lambda: ts_greedy(P, 0.1)
+
+    simple_trajectories = {tid : ts_greedy(trajectory, 0.1) for tid, trajectory in trajectories.items()}
+    yield from center_cases("geolife", simple_trajectories)
+    for subset, share in SUBSETS.items():
+        collection = dict(list(simple_trajectories.items())[:max(1, round(share * len(simple_trajectories)))])
+        yield from clustering_cases(f"geolife/{subset}", collection)
+
+
+if __name__ == "__main__":
+    """Times the kernels of part 2.  Run with --help for the options, e.g. --compare OLD NEW to flag regressions"""
+    main(cases)
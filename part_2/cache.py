@@ -0,0 +1,167 @@
+import hashlib
+import sqlite3
+from pathlib import Path
+from collections import OrderedDict
+
+from dtw import as_array
+from utils import dtw_distance, dtw_distances
+
+# Number of new on-disk entries written between commits
+COMMIT_EVERY = 1000
+
+
+class DTWCache:
+    """Memoizes dtw_distance by the content hashes of the two trajectories, with LRU eviction.
+
+    Trajectories with the same points share entries no matter which list or array holds them, so
+    unchanged centers in later Lloyd's iterations reuse earlier results.  If path is given, entries are
+    also kept in an sqlite file there, which later runs read when an entry is not in memory.
+
+    A readonly cache, e.g. in a worker process, never writes the file: its new entries are handed to the
+    one cache that does with take_new and add, since concurrent writers would lock each other out.
+    """
+
+    def __init__(self, maxsize=100000, path=None, readonly=False):
+        self.maxsize = maxsize
+        self.path = path
+        self.readonly = readonly
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._pending = 0
+        self._new = []
+
+        self.db = None
+        if path is not None and readonly:
+            if Path(path).exists():
+                self.db = sqlite3.connect(Path(path).resolve().as_uri() + "?mode=ro", uri=True)
+        elif path is not None:
+            self.db = sqlite3.connect(path)
+            self.db.execute("CREATE TABLE IF NOT EXISTS dtw (key TEXT PRIMARY KEY, distance REAL)")
+            self.db.commit()
+
+    def settings(self):
+        """Returns the arguments that create an equivalent cache, e.g. in a worker process."""
+        return self.maxsize, self.path
+
+    @staticmethod
+    def digest(trajectory):
+        """Returns the content hash of a trajectory."""
+        trajectory = as_array(trajectory)
+        return hashlib.blake2b(trajectory.tobytes(), digest_size=16).hexdigest()
+
+    def distance(self, P, Q, window=None, slope=None, P_digest=None, Q_digest=None, cutoff=None):
+        """Returns dtw_distance(P, Q, window, slope, cutoff), computing it only if it is not cached.  Digests can be passed in when already known.
+
+        Cached distances are exact, even above cutoff.  A computation abandoned at cutoff returns inf and is not cached.
+        """
+        P_digest = P_digest or self.digest(P)
+        Q_digest = Q_digest or self.digest(Q)
+        key = f"{P_digest}:{Q_digest}:{window}:{slope}"
+
+        dist = self._lookup(key)
+        if dist is not None:
+            return dist
+
+        self.misses += 1
+        dist = dtw_distance(P, Q, window, slope, cutoff)
+        if dist != float("inf") or cutoff is None:
+            self._store(key, dist)
+
+        return dist
+
+    def distances(self, P, candidates, window=None, slope=None, P_digest=None, digests=None, cutoff=None, nearest=False):
+        """Returns dtw_distances(P, candidates, window, slope, cutoff, nearest), computing the distances that are not cached in one batch."""
+        P_digest = P_digest or self.digest(P)
+        digests = digests or [self.digest(Q) for Q in candidates]
+        keys = [f"{P_digest}:{Q_digest}:{window}:{slope}" for Q_digest in digests]
+
+        dists = [self._lookup(key) for key in keys]
+        missing = [c for c, dist in enumerate(dists) if dist is None]
+        if not missing:
+            return dists
+
+        # Cached distances already bound the closest one
+        found = [dist for dist in dists if dist is not None]
+        if nearest and found:
+            cutoff = min(found) if cutoff is None else min(cutoff, min(found))
+
+        self.misses += len(missing)
+        computed = dtw_distances(P, [candidates[c] for c in missing], window, slope, cutoff, nearest)
+        for c, dist in zip(missing, computed):
+            dists[c] = dist
+            if dist != float("inf") or (cutoff is None and not nearest):
+                self._store(keys[c], dist)
+
+        return dists
+
+    def _lookup(self, key):
+        """Returns the cached distance of key, or None, and counts the hit."""
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+        if self.db is not None:
+            row = self.db.execute("SELECT distance FROM dtw WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.disk_hits += 1
+                self._remember(key, row[0])
+                return row[0]
+
+        return None
+
+    def _store(self, key, dist):
+        self._remember(key, dist)
+
+        if self.readonly:
+            self._new.append((key, dist))
+        elif self.db is not None:
+            self.db.execute("INSERT OR REPLACE INTO dtw VALUES (?, ?)", (key, dist))
+            self._pending += 1
+            if self._pending >= COMMIT_EVERY:
+                self.flush()
+
+    def _remember(self, key, dist):
+        self.entries[key] = dist
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def take_new(self):
+        """Returns the entries a readonly cache computed since the last call, and forgets them."""
+        new, self._new = self._new, []
+        return new
+
+    def add(self, entries):
+        """Stores (key, distance) entries computed elsewhere, e.g. by the readonly caches of worker processes."""
+        for key, dist in entries:
+            self._store(key, dist)
+
+    def record(self, hits, disk_hits, misses):
+        """Adds lookups made elsewhere, e.g. by the caches of worker processes, to the statistics."""
+        self.hits += hits
+        self.disk_hits += disk_hits
+        self.misses += misses
+
+    def stats(self):
+        """Returns the number of hits, disk hits and misses, and the overall hit rate."""
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+    def flush(self):
+        """Commits the on-disk entries written so far."""
+        if self.db is not None and not self.readonly:
+            self.db.commit()
+            self._pending = 0
+
+    def close(self):
+        self.flush()
+        if self.db is not None:
+            self.db.close()
+            self.db = None
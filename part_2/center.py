@@ -1,76 +1,66 @@
 import os
-import math
-import matplotlib.pyplot as plt
+import numpy as np
 
-from utils import dtw_distance, read_csv, ts_greedy
+from cache import DTWCache
+from dtw import as_array
+import plotting
+from pairwise import medoid, pairwise_distances
+from simplify import select, thresholds
+from utils import dtw_distances, read_csv
 
 
-def approach_1(trajectories):
-    dtw_dists = {}
+def approach_1(trajectories, workers=1, symmetric=True):
+    # DTW is symmetrized by computing each pair once; symmetric=False sums both orientations, as a loop over ordered pairs would
+    # Serially, each total is abandoned as soon as it exceeds the best total so far
+    if workers == 1:
+        return trajectories[medoid(trajectories, symmetric=symmetric)]
 
-    for tid, trajectory in trajectories.items():
-        dtw_dists[tid] = 0
+    # Otherwise the pairs are spread over workers processes (all CPUs if None)
+    distances = pairwise_distances(trajectories, workers=workers, symmetric=symmetric)
 
-        for tid2, trajectory2 in trajectories.items():
-            if tid != tid2:
-                dtw_dists[tid] += dtw_distance(trajectory, trajectory2)
-    
-    min_dist = float("inf")
-    min_tid = None
-    for tid, dist in dtw_dists.items():
-        if dist < min_dist:
-            min_dist = dist
-            min_tid = tid
-    
-    return trajectories[min_tid]
+    return distances.center(trajectories)
 
 
-def approach_2(trajectories):
-    max_len = 0
+def approach_2(trajectories, length=None):
+    # The center has as many points as the longest trajectory, unless a fixed length is given
+    if length is None:
+        length = max(len(trajectory) for trajectory in trajectories.values())
 
+    # Resamples every trajectory to the same number of points and averages them
+    total = np.zeros((length, 2))
     for trajectory in trajectories.values():
-        if len(trajectory) > max_len:
-            max_len = len(trajectory)
-    
-    center = []
+        total += resample(trajectory, length)
 
-    for t in range(max_len):
-        x_tot = 0
-        y_tot = 0
+    center = total / len(trajectories)
 
-        for trajectory in trajectories.values():
-            t_scaled = t * (len(trajectory) - 1)/(max_len - 1)
-            x, y = interpolate(trajectory, t_scaled)
+    return list(zip(center[:, 0].tolist(), center[:, 1].tolist()))
 
-            x_tot += x
-            y_tot += y
-        
-        x_center = x_tot/len(trajectories.items())
-        y_center = y_tot/len(trajectories.items())
 
-        center.append((x_center, y_center))
+def resample(trajectory, length):
+    # One interpolation per coordinate, at length evenly spaced positions along the trajectory
+    trajectory = as_array(trajectory)
+    steps = np.arange(len(trajectory))
+    t_scaled = np.linspace(0, len(trajectory) - 1, length)
 
-    return center
+    return np.column_stack((np.interp(t_scaled, steps, trajectory[:, 0]), np.interp(t_scaled, steps, trajectory[:, 1])))
 
 
-def interpolate(trajectory, t):
-    t_floor = math.floor(t)
-    t_ceil = math.ceil(t)
+def average_dtw(center, trajectories, cache=None):
+    # The center is scored against all trajectories in batches
+    if cache is not None:
+        dists = cache.distances(center, list(trajectories.values()))
+    else:
+        dists = dtw_distances(center, list(trajectories.values()))
 
-    x = trajectory[t_floor][0] + (trajectory[t_ceil][0] - trajectory[t_floor][0]) * (t - t_floor)
-    y = trajectory[t_floor][1] + (trajectory[t_ceil][1] - trajectory[t_floor][1]) * (t - t_floor)
-
-    return x, y
-
-
-def average_dtw(center, trajectories):
     total_dtw = 0
-    for trajectory in trajectories.values():
-        total_dtw += dtw_distance(center, trajectory)
+    for dist in dists:
+        total_dtw += dist
     return total_dtw/len(trajectories.items())
 
 
 def plot(fig_path, trajectories):
+    import matplotlib.pyplot as plt
+
     fig, ax = plt.subplots()
 
     for label, trajectory in trajectories.items():
@@ -82,8 +72,37 @@ def plot(fig_path, trajectories):
     ax.legend()
 
     fig.savefig(fig_path)
+    plt.close(fig)
 
 
+def experiment(csv_path, fig_dir, tids, epsilons, cache = None):
+    """Computes the center of the trajectories tids, simplified with each epsilon, and prints its average distance to the raw trajectories.  Approach 2 only runs without simplification."""
+    trajectories = read_csv(csv_path, tids)
+
+    # Each trajectory is split once and then filtered for each epsilon
+    removals = {tid : thresholds(trajectory) for tid, trajectory in trajectories.items()}
+
+    for epsilon in epsilons:
+        print(f"Computing center trajectories for epsilon = {epsilon}:")
+        print("-----------------------------------------------------")
+
+        simple_trajectories = {tid : select(trajectory, removals[tid], epsilon) for tid, trajectory in trajectories.items()}
+
+        center_1 = approach_1(simple_trajectories)
+        simple_trajectories["Approach 1"] = center_1
+        average_1 = average_dtw(center_1, trajectories, cache)
+        print(f"Average distance for Approach 1: {average_1}")
+
+        if epsilon == 0:
+            center_2 = approach_2(simple_trajectories)
+            simple_trajectories["Approach 2"] = center_2
+            average_2 = average_dtw(center_2, trajectories, cache)
+            print(f"Average distance for Approach 2: {average_2}")
+
+        plotting.submit(plot, os.path.join(fig_dir, f"center_trajectories_{epsilon}.png"), simple_trajectories)
+
+        print("-----------------------------------------------------")
+
 if __name__ == "__main__":
     tids = {
         "115-20080527225031",
@@ -99,31 +118,14 @@ if __name__ == "__main__":
         "115-20080707230001",
     }
 
-    if not os.path.exists("./figures"):
-        os.mkdir("./figures")
-    if not os.path.exists("./figures/task_4"):
-        os.mkdir("./figures/task_4")
-
-    trajectories = read_csv("data/geolife-cars-upd8.csv", tids)
-
-    for epsilon in [0, 0.03, 0.1, 0.3]:
-        print(f"Computing center trajectories for epsilon = {epsilon}:")
-        print("-----------------------------------------------------")
-
-        simple_trajectories = {tid : ts_greedy(trajectory,epsilon) for tid, trajectory in trajectories.items()}
+    os.makedirs("./figures/task_4", exist_ok = True)
 
-        center_1 = approach_1(simple_trajectories)
-        simple_trajectories["Approach 1"] = center_1
-        average_1 = average_dtw(center_1, trajectories)
-        print(f"Average distance for Approach 1: {average_1}")
+    # Distances from earlier runs are reused from the sqlite file DTW_CACHE, if it is set
+    cache = DTWCache(path = os.environ.get("DTW_CACHE"))
 
-        if epsilon == 0:
-            center_2 = approach_2(simple_trajectories)
-            simple_trajectories["Approach 2"] = center_2
-            average_2 = average_dtw(center_2, trajectories)
-            print(f"Average distance for Approach 2: {average_2}")
+    experiment("data/geolife-cars-upd8.csv", "./figures/task_4", tids, [0, 0.03, 0.1, 0.3], cache)
 
-        plot(f"./figures/task_4/center_trajectories_{epsilon}.png", simple_trajectories)
-
-        print("-----------------------------------------------------")
+    cache.close()
+    print(f"DTW cache: {cache.stats()}")
 
+    plotting.wait()
@@ -1,62 +1,319 @@
 import os
 import random
-import matplotlib.pyplot as plt
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+import instrument
+from cache import DTWCache
+from center import approach_2, resample
+from dtw import as_array, envelope, lb_keogh, lb_kim
+from fretchet import fretchet_kernel
+from pairwise import pairwise_distances
+import plotting
+from stream import stream_trajectories
+from utils import dtw_distance, dtw_distances, ts_greedy
+
+# Trajectories of a worker process, set once by the pool initializer
+_shared = {}
+
+"""Returns the k center trajectories and an array of costs for each iteration.  center_fn computes the center of a partition, e.g. approach_2 or the center method of a pairwise DistanceMatrix for medoids.  If skipped is a list, the number of DTW evaluations avoided in each iteration is appended to it.  With workers > 1 the assignment step runs on a pool of that many processes.  If cache is a DTWCache, assignment distances are looked up in it (each worker keeps its own readonly cache with the same settings, and sends its new distances back to be stored in cache)"""
+def lloyds(trajectories, seed_fn, k, t_max, window = None, slope = None, skipped = None, center_fn = approach_2, workers = 1, cache = None):
+    # Initialize centers via seeding algorithm
+    centers = seed_fn(trajectories, k)
+
+    # Ship the trajectories to the workers once, split into contiguous chunks
+    pool, chunks = None, None
+    if workers > 1:
+        arrays = [as_array(trajectory) for trajectory in trajectories.values()]
+        size = -(-len(arrays) // (4 * workers)) or 1
+        chunks = [(start, min(start + size, len(arrays))) for start in range(0, len(arrays), size)]
+        pool = ProcessPoolExecutor(workers, initializer = _init_worker, initargs = (arrays, cache.settings() if cache is not None else None, instrument.enabled))
+
+    # Array for costs
+    costs = []
+
+    # The pool is shut down even if an iteration fails, so no worker process outlives the call
+    try:
+        # Run for t_max iterations
+        for t in range(t_max):
+            # Initialize cost for this iteration
+            costs.append(0)
+
+            # Sort trajectories into partitions
+            with instrument.span("lloyds.assignment", iteration = t):
+                partitions, costs[t], pruned = assign(trajectories, centers, window, slope, pool, chunks, cache)
+            if skipped is not None:
+                skipped.append(pruned)
+
+            # Compute new centers
+            with instrument.span("lloyds.update", iteration = t):
+                new_centers = []
+                for partition in partitions:
+                    if partition:
+                        new_center = center_fn({tid : trajectories[tid] for tid in partition})
+                        new_centers.append(new_center)
+                    else:
+                        new_center = seed_fn(trajectories)[0]
+                        new_centers.append(new_center)
+
+            # If the algorithm has converged, stop
+            if new_centers == centers:
+                break
+
+            # Otherwise, run the next iteration with the new centers
+            else:
+                centers = new_centers
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    return centers, costs
+
+"""Mini-batch variant of lloyds for large collections (Sculley, 2010).  Each iteration assigns a random batch of batch_size trajectories, and moves every center toward the resampled trajectories assigned to it at a learning rate of one over the number of trajectories it has been assigned so far, so a center is the running average of approach_2 over its assignments.  Centers keep the length of their seed.  Returns the k center trajectories and an array of costs for each iteration, the cost of the batch scaled to the whole collection.  Stops once the smoothed cost has not dropped by more than a fraction tol for patience iterations.  If skipped is a list, the number of DTW evaluations avoided in each iteration is appended to it"""
+def minibatch_lloyds(trajectories, seed_fn, k, t_max, batch_size = 100, tol = 1e-3, patience = 10, window = None, slope = None, skipped = None):
+    # Initialize centers via seeding algorithm
+    centers = [as_array(center).copy() for center in seed_fn(trajectories, k)]
+    counts = [0] * len(centers)
+
+    tids = list(trajectories.keys())
+    batch_size = min(batch_size, len(tids))
+
+    # The batch costs are noisy, so convergence is judged on their exponentially weighted average
+    smoothing = min(1.0, 2 * batch_size / (len(tids) + 1))
+    smoothed, best, stale = None, None, 0
+
+    # Array for costs
+    costs = []
+
+    # Run for at most t_max iterations
+    for t in range(t_max):
+        batch = {tid : trajectories[tid] for tid in random.sample(tids, batch_size)}
+
+        # Sort the batch into partitions
+        with instrument.span("lloyds.assignment", iteration = t, batch = batch_size):
+            partitions, cost, pruned = assign(batch, centers, window, slope)
+        if skipped is not None:
+            skipped.append(pruned)
+        costs.append(cost * len(tids) / batch_size)
+
+        # Move each center toward its trajectories, more slowly the more it has seen
+        with instrument.span("lloyds.update", iteration = t):
+            for center, partition in enumerate(partitions):
+                for tid in partition:
+                    counts[center] += 1
+                    centers[center] += (resample(batch[tid], len(centers[center])) - centers[center]) / counts[center]
+
+        # If the smoothed cost has stopped improving, stop
+        smoothed = costs[t] if smoothed is None else smoothed + smoothing * (costs[t] - smoothed)
+        if best is None or smoothed < best * (1 - tol):
+            best, stale = smoothed, 0
+        else:
+            stale += 1
+            if stale >= patience:
+                break
 
-from center import approach_2
-from utils import dtw_distance, read_csv, ts_greedy
+    return [list(zip(center[:, 0].tolist(), center[:, 1].tolist())) for center in centers], costs
 
-"""Returns the k center trajectories and an array of costs for each iteration """
-def lloyds(trajectories, seed_fn, k, t_max):
+"""Lloyd's algorithm for a metric distance such as the discrete Fretchet distance, pruned with the triangle inequality (Elkan's bounds).  Returns the k center trajectories and an array of costs for each iteration.  If skipped is a list, the fraction of the n x k trajectory-to-center evaluations saved in each iteration (net of the center-to-center and center drift evaluations) is appended to it"""
+def lloyds_metric(trajectories, seed_fn, k, t_max, distance = fretchet_kernel, center_fn = approach_2, skipped = None):
     # Initialize centers via seeding algorithm
     centers = seed_fn(trajectories, k)
 
+    tids = list(trajectories.keys())
+    arrays = [as_array(trajectories[tid]) for tid in tids]
+    n = len(arrays)
+
+    # Assigned center of each trajectory, and lower bounds on its distance to every center
+    assigned = [0] * n
+    lower = np.zeros((n, len(centers)))
+
     # Array for costs
     costs = []
 
     # Run for t_max iterations
     for t in range(t_max):
+        evaluations = 0
+
+        # Half the distance between two centers: a trajectory closer than that to one of them cannot be closer to the other
+        center_arrays = [as_array(center) for center in centers]
+        half = pairwise_distances(dict(enumerate(center_arrays)), distance, workers = 1).matrix / 2
+        evaluations += len(centers) * (len(centers) - 1) // 2
+        nearest = np.where(np.eye(len(centers), dtype = bool), np.inf, half).min(axis = 1)
+
         # Initialize cost for this iteration
         costs.append(0)
 
-        # Array for partitiions
+        # Array for partitions
         partitions = [[] for _ in centers]
 
         # Sort trajectories into partitions
-        for tid, trajectory in trajectories.items():
-            min_dist = float("inf")
-            min_center = None
+        for x, trajectory in enumerate(arrays):
+            a = assigned[x]
 
-            for i, center in enumerate(centers):
-                dist = dtw_distance(trajectory, center)
-                if dist < min_dist:
-                    min_dist = dist
-                    min_center = i
+            # The distance to the assigned center is always computed, as it is needed for the cost
+            upper = distance(trajectory, center_arrays[a])
+            lower[x, a] = upper
+            evaluations += 1
+
+            if upper > nearest[a]:
+                for j in range(len(centers)):
+                    if j == a or upper <= lower[x, j] or upper <= half[a, j]:
+                        continue
+
+                    dist = distance(trajectory, center_arrays[j])
+                    lower[x, j] = dist
+                    evaluations += 1
+                    if dist < upper:
+                        a, upper = j, dist
 
-            partitions[min_center].append(tid)
+            assigned[x] = a
+            partitions[a].append(tids[x])
 
             # Update cost
-            costs[t] += min_dist
+            costs[t] += upper
 
         # Compute new centers
         new_centers = []
         for partition in partitions:
             if partition:
-                new_center = approach_2({tid : trajectories[tid] for tid in partition})
+                new_center = center_fn({tid : trajectories[tid] for tid in partition})
                 new_centers.append(new_center)
             else:
                 new_center = seed_fn(trajectories)[0]
                 new_centers.append(new_center)
 
+        # Loosen the lower bounds by how far each center moved
+        converged = new_centers == centers
+        if not converged:
+            drift = np.array([distance(center, new_center) for center, new_center in zip(center_arrays, new_centers)])
+            evaluations += len(centers)
+            lower = np.maximum(lower - drift, 0)
+
+        if skipped is not None:
+            skipped.append(1 - evaluations / (n * len(centers)))
+
         # If the algorithm has converged, stop
-        if new_centers == centers:
+        if converged:
             break
 
         # Otherwise, run the next iteration with the new centers
         else:
             centers = new_centers
-            
+
     return centers, costs
 
+"""Assigns every trajectory to its closest center.  Returns the partitions, the cost and the number of DTW evaluations avoided by lower bounds.  If pool is given, the trajectories it was started with are assigned in the given (start, end) chunks"""
+def assign(trajectories, centers, window = None, slope = None, pool = None, chunks = None, cache = None):
+    centers = [as_array(center) for center in centers]
+
+    if pool is None:
+        labels, dists, pruned = closest_centers([as_array(trajectory) for trajectory in trajectories.values()], centers, window, slope, cache)
+    else:
+        # Only the centers are sent each round; chunks come back in order, so the result matches the serial path
+        labels, dists, pruned = [], [], 0
+        for chunk_labels, chunk_dists, chunk_pruned, chunk_stats, chunk_entries, chunk_counters in pool.map(_closest_chunk, [(start, end, centers, window, slope) for start, end in chunks]):
+            labels += chunk_labels
+            dists += chunk_dists
+            pruned += chunk_pruned
+            if cache is not None:
+                cache.record(*chunk_stats)
+                cache.add(chunk_entries)
+            instrument.merge_counters(chunk_counters)
+
+        # Only this process writes the on-disk cache, so the workers read every entry of earlier rounds
+        if cache is not None:
+            cache.flush()
+
+    # Array for partitions
+    partitions = [[] for _ in centers]
+    cost = 0
+
+    for tid, label, dist in zip(trajectories.keys(), labels, dists):
+        partitions[label].append(tid)
+
+        # Update cost
+        cost += dist
+
+    return partitions, cost, pruned
+
+"""Returns the index of and distance to the closest center for each trajectory, and the number of DTW evaluations avoided by lower bounds"""
+def closest_centers(trajectories, centers, window = None, slope = None, cache = None):
+    labels = []
+    dists = []
+    pruned = 0
+
+    if cache is not None:
+        center_digests = [cache.digest(center) for center in centers]
+
+    # Envelopes only depend on the center and the number of rows, so they are shared between trajectories
+    envelopes = {}
+
+    for trajectory in trajectories:
+        if cache is not None:
+            digest = cache.digest(trajectory)
+
+        # The center with the cheapest lower bound is computed first, so that the bounds can prune the others
+        kims = [lb_kim(trajectory, center) for center in centers]
+        order = sorted(range(len(centers)), key = lambda i: kims[i])
+        min_center = order[0]
+        if cache is not None:
+            min_dist = cache.distance(trajectory, centers[min_center], window, slope, digest, center_digests[min_center])
+        else:
+            min_dist = dtw_distance(trajectory, centers[min_center], window, slope)
+
+        candidates = []
+        for i in order[1:]:
+            # A center can only win if it is strictly closer, or equally close with a smaller index
+            if kims[i] > min_dist or (kims[i] == min_dist and i > min_center):
+                pruned += 1
+                continue
+
+            key = (i, len(trajectory) if window is not None or slope is not None else 0)
+            if key not in envelopes:
+                envelopes[key] = envelope(centers[i], len(trajectory), window, slope)
+            keogh = lb_keogh(trajectory, envelopes[key], len(centers[i]))
+            if keogh > min_dist or (keogh == min_dist and i > min_center):
+                pruned += 1
+                continue
+
+            candidates.append(i)
+
+        # The remaining centers are scored in one batch, each abandoned once it cannot be the closest
+        if candidates:
+            if cache is not None:
+                candidate_dists = cache.distances(trajectory, [centers[i] for i in candidates], window, slope, digest, [center_digests[i] for i in candidates], min_dist, nearest = True)
+            else:
+                candidate_dists = dtw_distances(trajectory, [centers[i] for i in candidates], window, slope, min_dist, nearest = True)
+            for i, dist in zip(candidates, candidate_dists):
+                if dist < min_dist or (dist == min_dist and i < min_center):
+                    min_dist = dist
+                    min_center = i
+
+        labels.append(min_center)
+        dists.append(min_dist)
+
+    return labels, dists, pruned
+
+"""Stores the trajectories of a worker process once, when the pool starts, creates its readonly cache and turns on its instrumentation if the parent's is on"""
+def _init_worker(trajectories, cache_settings = None, instrumented = False):
+    if instrumented:
+        instrument.enable()
+    _shared["trajectories"] = trajectories
+    _shared["cache"] = DTWCache(*cache_settings, readonly = True) if cache_settings is not None else None
+
+"""Assigns the trajectories start to end of a worker process.  Also returns the worker's cache hits, disk hits and misses for this chunk, the distances it computed for the parent's cache, and its instrumentation counters"""
+def _closest_chunk(args):
+    start, end, centers, window, slope = args
+    cache = _shared["cache"]
+    before = (cache.hits, cache.disk_hits, cache.misses) if cache is not None else (0, 0, 0)
+
+    labels, dists, pruned = closest_centers(_shared["trajectories"][start:end], centers, window, slope, cache)
+
+    after = (cache.hits, cache.disk_hits, cache.misses) if cache is not None else (0, 0, 0)
+    entries = cache.take_new() if cache is not None else []
+
+    return labels, dists, pruned, tuple(b - a for a, b in zip(before, after)), entries, instrument.take_counters()
+
 """Defines k random center trajectories with a random sample. K is at default 1"""
 def random_seed(trajectories, k = 1):
     
@@ -76,12 +333,14 @@ def proposed_seed(trajectories, k = 1):
     # Select remaining centers
     for _ in range(k - 1):
 
-        # Compute minimum distance to already-selected centers
-        for tid, trajectory in trajectories.items():
-            for center in seed:
-                dist = dtw_distance(trajectory, trajectories[center])
-                if dist**2 < min_dist[tid]:
-                    min_dist[tid] = dist**2
+        # Compute minimum distance to already-selected centers.  Only the newest center can lower it, so it is
+        # scored against every trajectory in batches, each abandoned once it cannot beat the trajectory's minimum
+        newest = trajectories[seed[-1]]
+        cutoffs = [min_dist[tid]**0.5 for tid in trajectories.keys()]
+        dists = dtw_distances(newest, list(trajectories.values()), cutoff = cutoffs, reverse = True)
+        for tid, dist in zip(trajectories.keys(), dists):
+            if dist**2 < min_dist[tid]:
+                min_dist[tid] = dist**2
 
         # Select the next center using a distribution weighted by the minimum distance
         weights = [min_dist[tid] for tid in trajectories.keys()]
@@ -91,6 +350,8 @@ def proposed_seed(trajectories, k = 1):
 
 """Plot function for cost of clustering vs k"""
 def plot_1(fig_path, k, random_cost, proposed_cost):
+    import matplotlib.pyplot as plt
+
     fig, ax = plt.subplots()
 
     ax.plot(k, random_cost, label = "Random Seeding")
@@ -101,9 +362,12 @@ def plot_1(fig_path, k, random_cost, proposed_cost):
     ax.legend()
 
     fig.savefig(fig_path)
+    plt.close(fig)
 
 """Plot function for center trajectories"""
 def plot_2(fig_path, centers):
+    import matplotlib.pyplot as plt
+
     fig, ax = plt.subplots()
 
     label = 0
@@ -117,9 +381,12 @@ def plot_2(fig_path, centers):
     ax.set_title("Task 5: Cluster Centers")
 
     fig.savefig(fig_path)
+    plt.close(fig)
 
 """Plot function for costs vs iterations"""
 def plot_3(fig_path, random_cost, proposed_cost):
+    import matplotlib.pyplot as plt
+
     fig, ax = plt.subplots()
 
     random_iters = [i + 1 for i in range(len(random_cost))]
@@ -133,20 +400,65 @@ def plot_3(fig_path, random_cost, proposed_cost):
     ax.legend()
 
     fig.savefig(fig_path)
+    plt.close(fig)
+
+
+def experiment(trajectories, fig_dir, k, t_max, iters, workers = 1, cache = None, batch_size = None, coordinator = None):
+    """Runs Lloyd's algorithm iters times with random and with proposed seeding, printing the final costs and the DTW evaluations avoided.
+    Plots the centers of the first proposed run and the average cost per iteration of both seedings, which are returned.
+    With a batch_size, runs minibatch_lloyds instead, which uses neither workers nor the cache.  With a distributed.Coordinator,
+    runs on the shards of its workers, and trajectories is not used."""
+    def run(seed_fn, skipped):
+        if coordinator is not None:
+            from distributed import lloyds as distributed_lloyds
+            return distributed_lloyds(coordinator, seed_fn, k, t_max, skipped = skipped)
+        if batch_size:
+            return minibatch_lloyds(trajectories, seed_fn, k, t_max, batch_size, skipped = skipped)
+        return lloyds(trajectories, seed_fn, k, t_max, skipped = skipped, workers = workers, cache = cache)
+
+    random_cost = []
+    proposed_cost = []
+    for iter in range(iters):
+        skipped = []
+        centers, costs = run(random_seed, skipped)
+        random_cost.append(costs)
+        print(f"Random seeding, run {iter}: cost {costs[-1]}, DTW evaluations avoided per iteration: {skipped}")
+
+        skipped = []
+        centers, costs = run(proposed_seed, skipped)
+        proposed_cost.append(costs)
+        print(f"Proposed seeding, run {iter}: cost {costs[-1]}, DTW evaluations avoided per iteration: {skipped}")
+
+        if iter == 0:
+            plotting.submit(plot_2, os.path.join(fig_dir, "centers.png"), centers)
+
+    random_avg = average_costs(random_cost)
+    proposed_avg = average_costs(proposed_cost)
+    plotting.submit(plot_3, os.path.join(fig_dir, "cost.png"), random_avg, proposed_avg)
+
+    return random_avg, proposed_avg
 
+def average_costs(runs):
+    """Returns the average cost per iteration over several runs of Lloyd's algorithm.  Runs that stopped early keep their final cost."""
+    length = max(len(costs) for costs in runs)
+
+    return [sum(costs[min(i, len(costs) - 1)] for costs in runs) / len(runs) for i in range(length)]
 
 if __name__ == "__main__":
-    if not os.path.exists("./figures"):
-        os.mkdir("./figures")
-    if not os.path.exists("./figures/task_5"):
-        os.mkdir("./figures/task_5")
+    os.makedirs("./figures/task_5", exist_ok = True)
 
-    trajectories = read_csv("data/geolife-cars-upd8.csv")
-    simple_trajectories = {tid : ts_greedy(trajectory, 0.1) for tid, trajectory in trajectories.items()}
+    # Trajectories are simplified as they stream in, so the raw points are never all held in memory.  The rows of
+    # each trajectory must be contiguous in the file; pass contiguous = False to stream_trajectories otherwise
+    simple_trajectories = {tid : ts_greedy(trajectory, 0.1) for tid, trajectory in stream_trajectories("data/geolife-cars-upd8.csv")}
 
     ITERS = 3
     K_VAL = 12
     T_MAX = 100
+    # Serial by default; set WORKERS to run the assignment step on that many processes
+    WORKERS = int(os.environ.get("WORKERS", "1"))
+
+    # Distances from earlier iterations are reused in memory, and across runs from the sqlite file DTW_CACHE if it is set
+    cache = DTWCache(path = os.environ.get("DTW_CACHE"))
 
     random_cost = []
     proposed_cost = []
@@ -182,38 +494,10 @@ if __name__ == "__main__":
     proposed_avg = [c/ITERS for c in proposed_cost]
     plot_1("./figures/task_5/k_cost.png", [4, 6, 8, 10, 12], random_avg, proposed_avg)"""
 
-    """With our ideal k-value, k=12, run Lloyd's for our proposed seeding and report the final center trajectories"""
-
-    random_cost = []
-    proposed_cost = []
-    for iter in range(ITERS):
-        centers, costs = lloyds(simple_trajectories, random_seed, K_VAL, T_MAX)
-        random_cost.append(costs)
+    """With our ideal k-value, k=12, run Lloyd's for our proposed seeding and random seeding and report the final center trajectories and the costs over iterations"""
+    experiment(simple_trajectories, "./figures/task_5", K_VAL, T_MAX, ITERS, WORKERS, cache)
 
-        centers, costs = lloyds(simple_trajectories, proposed_seed, K_VAL, T_MAX)
-        proposed_cost.append(costs)
+    cache.close()
+    print(f"DTW cache: {cache.stats()}")
 
-        if iter == 0:
-            plot_2("./figures/task_5/centers.png", centers)
-
-    """With our ideal k-value, k=12, run Lloyd's for our proposed seeding and random seeding and report the costs over iterations"""
-
-    max_len = max(len(random_cost[0]), len(random_cost[1]), len(random_cost[2]))
-    if len(random_cost[0]) < max_len:
-        random_cost[0] + (random_cost[0][-1] * (max_len - len(random_cost[0])))
-    if len(random_cost[1]) < max_len:
-        random_cost[1] + (random_cost[1][-1] * (max_len - len(random_cost[1])))   
-    if len(random_cost[2]) < max_len:
-        random_cost[2] + (random_cost[2][-1] * (max_len - len(random_cost[2])))
-    random_avg = [(random_cost[0][i] + random_cost[1][i] + random_cost[2][i])/3 for i in range(len(random_cost[0]))]
-
-    max_len = max(len(proposed_cost[0]), len(proposed_cost[1]), len(proposed_cost[2]))
-    if len(proposed_cost[0]) < max_len:
-        proposed_cost[0] + (proposed_cost[0][-1] * (max_len - len(proposed_cost[0])))
-    if len(proposed_cost[1]) < max_len:
-        proposed_cost[1] + (proposed_cost[1][-1] * (max_len - len(proposed_cost[1])))   
-    if len(proposed_cost[2]) < max_len:
-        proposed_cost[2] + (proposed_cost[2][-1] * (max_len - len(proposed_cost[2])))
-    proposed_avg = [(proposed_cost[0][i] + proposed_cost[1][i] + proposed_cost[2][i])/3 for i in range(len(proposed_cost[0]))]
-
-    plot_3("./figures/task_5/cost.png", random_avg, proposed_avg)
+    plotting.wait()
@@ -0,0 +1,316 @@
+import os
+import sys
+import math
+import time
+import random
+import zlib
+import numpy as np
+from multiprocessing import AuthenticationError, Pipe, Process
+from multiprocessing.connection import Client, Listener
+
+import instrument
+from center import resample
+from cluster import closest_centers
+from dtw import as_array
+from stream import stream_trajectories
+from utils import ts_greedy
+
+# Environment variable with the shared secret of the coordinator and its workers; connections without it are refused
+AUTHKEY_VARIABLE = "TRAJECTORY_AUTHKEY"
+
+# Hosts a worker may listen on with a secret it made up, since only local users can reach them
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+
+# Methods of Worker a coordinator may call, besides "stop"
+METHODS = ("load", "sample", "assign", "update")
+
+# Attempts to reach a worker that dropped its connection, and the seconds between them
+RETRIES = 20
+RETRY_DELAY = 0.5
+
+# Number of trajectories sampled from the shards for seeding and for replacing empty clusters
+SEED_SAMPLE = 1000
+
+
+def environment_authkey():
+    """Returns the shared secret in the environment variable AUTHKEY_VARIABLE, or None if it is not set."""
+    key = os.environ.get(AUTHKEY_VARIABLE)
+    return key.encode() if key else None
+
+
+def shard_of(tid, count):
+    """Returns the shard of trajectory tid out of count shards, the same in every process."""
+    return zlib.crc32(tid.encode()) % count
+
+
+def read_shard(csv_path, index, count, epsilon=None):
+    """Returns the trajectories of shard index out of count in the csv file, simplified by TS-greedy if epsilon is given.  The rows of each trajectory must be contiguous in the file."""
+    shard = {}
+    for tid, trajectory in stream_trajectories(csv_path):
+        if shard_of(tid, count) == index:
+            shard[tid] = ts_greedy(trajectory, epsilon) if epsilon else trajectory
+
+    return shard
+
+
+class Worker:
+    """The shard of one worker process and its answers to the coordinator.
+
+    A shard is loaded from its source, either a dict of trajectories or the arguments of read_shard.  The
+    labels of the last assignment are kept for the update step of the same round; a worker that lost them,
+    e.g. after a restart, assigns its shard again.
+    """
+
+    def __init__(self):
+        self.tids = []
+        self.arrays = []
+        self.labels = None
+
+    def load(self, source):
+        trajectories = source if isinstance(source, dict) else read_shard(*source)
+        self.tids = list(trajectories.keys())
+        self.arrays = [as_array(trajectory) for trajectory in trajectories.values()]
+        self.labels = None
+
+        return len(self.tids)
+
+    def sample(self, size, seed):
+        chosen = random.Random(seed).sample(range(len(self.tids)), min(size, len(self.tids)))
+
+        return {self.tids[i] : list(map(tuple, self.arrays[i].tolist())) for i in chosen}
+
+    def assign(self, t, centers, window, slope):
+        """Returns the cost of the shard, the DTW evaluations avoided, and the size and longest trajectory of each cluster."""
+        labels, dists, pruned = closest_centers(self.arrays, centers, window, slope)
+        self.labels = (t, labels)
+
+        labels = np.array(labels, dtype=int)
+        counts = np.bincount(labels, minlength=len(centers))
+        longest = np.zeros(len(centers), dtype=int)
+        np.maximum.at(longest, labels, np.array([len(array) for array in self.arrays], dtype=int))
+
+        return sum(dists), pruned, counts.tolist(), longest.tolist()
+
+    def update(self, t, centers, window, slope, lengths):
+        """Returns the sum of the trajectories of each cluster resampled to its length, or None for empty clusters."""
+        if self.labels is None or self.labels[0] != t:
+            self.assign(t, centers, window, slope)
+
+        sums = [np.zeros((length, 2)) if length else None for length in lengths]
+        for array, label in zip(self.arrays, self.labels[1]):
+            sums[label] += resample(array, lengths[label])
+
+        return sums
+
+
+def serve(address, authkey, ready=None):
+    """Runs a worker at address until the coordinator sends "stop".  The address is sent to the connection ready once listening.
+
+    Only connections with authkey are accepted, since requests are unpickled.  Requests are tuples of one
+    of METHODS and its arguments, answered in order; a connection sending anything else is dropped.  The
+    coordinator may drop the connection and connect again, and the shard is kept until it loads another one.
+    """
+    if not authkey:
+        raise ValueError("a worker needs a shared secret to authenticate its coordinator")
+
+    worker = Worker()
+    with Listener(address, authkey=authkey) as listener:
+        if ready is not None:
+            ready.send(listener.address)
+            ready.close()
+
+        while True:
+            try:
+                connection = listener.accept()
+            except (AuthenticationError, EOFError, ConnectionError):
+                # A client without the secret is turned away, and the worker keeps listening
+                continue
+
+            with connection:
+                while True:
+                    try:
+                        method, *args = connection.recv()
+                    except (EOFError, OSError):
+                        break
+                    if method == "stop":
+                        connection.send(None)
+                        return
+                    if method not in METHODS:
+                        break
+                    connection.send(getattr(worker, method)(*args))
+
+
+def start_worker(authkey, address=("localhost", 0)):
+    """Starts a worker in a local process, in place of a remote node.  Returns the process and its address."""
+    receiver, sender = Pipe(duplex=False)
+    process = Process(target=serve, args=(address, authkey, sender), daemon=True)
+    process.start()
+    sender.close()
+    address = receiver.recv()
+    receiver.close()
+
+    return process, address
+
+
+class Coordinator:
+    """Connects to the workers at addresses and loads one shard source into each.
+
+    A request is broadcast to every worker before any answer is read, so the workers run concurrently.  A
+    worker that fails mid-request, e.g. because it was restarted, is reconnected to, loaded with its shard
+    again and asked again, up to RETRIES times.
+    """
+
+    def __init__(self, addresses, sources, authkey):
+        if len(addresses) != len(sources):
+            raise ValueError("every worker needs exactly one shard source")
+
+        self.addresses = list(addresses)
+        self.sources = list(sources)
+        self.authkey = authkey
+        self.connections = [None] * len(addresses)
+        self.restarts = 0
+
+        self.sizes = self.broadcast([("load", source) for source in self.sources])
+
+    @classmethod
+    def from_trajectories(cls, trajectories, addresses, authkey):
+        """Returns the coordinator of trajectories split into one shard per worker, for testing on one machine."""
+        shards = [{} for _ in addresses]
+        for tid, trajectory in trajectories.items():
+            shards[shard_of(tid, len(addresses))][tid] = trajectory
+
+        return cls(addresses, shards, authkey)
+
+    @classmethod
+    def from_csv(cls, csv_path, addresses, authkey, epsilon=None):
+        """Returns the coordinator of workers that each read their own shard of the csv file."""
+        return cls(addresses, [(csv_path, index, len(addresses), epsilon) for index in range(len(addresses))], authkey)
+
+    def __len__(self):
+        return sum(self.sizes)
+
+    def broadcast(self, requests):
+        """Sends each worker its request, or the same request to all, and returns their answers in order."""
+        if isinstance(requests, tuple):
+            requests = [requests] * len(self.addresses)
+
+        failed = set()
+        for w, request in enumerate(requests):
+            try:
+                if self.connections[w] is None:
+                    self.connections[w] = Client(self.addresses[w], authkey=self.authkey)
+                self.connections[w].send(request)
+            except (EOFError, OSError):
+                failed.add(w)
+
+        answers = []
+        for w, request in enumerate(requests):
+            try:
+                if w in failed:
+                    raise ConnectionError
+                answers.append(self.connections[w].recv())
+            except (EOFError, OSError):
+                answers.append(self._recover(w, request))
+
+        return answers
+
+    def _recover(self, w, request):
+        """Reconnects to worker w, loads its shard again and answers request."""
+        for _ in range(RETRIES):
+            self._drop(w)
+            try:
+                self.connections[w] = Client(self.addresses[w], authkey=self.authkey)
+                if request[0] != "load":
+                    self.connections[w].send(("load", self.sources[w]))
+                    self.connections[w].recv()
+                self.connections[w].send(request)
+                answer = self.connections[w].recv()
+            except (EOFError, OSError):
+                time.sleep(RETRY_DELAY)
+                continue
+
+            self.restarts += 1
+            if instrument.enabled:
+                instrument.count("distributed.restarts")
+            return answer
+
+        raise ConnectionError(f"worker at {self.addresses[w]} did not come back after {RETRIES} attempts")
+
+    def _drop(self, w):
+        if self.connections[w] is not None:
+            self.connections[w].close()
+            self.connections[w] = None
+
+    def sample(self, size=SEED_SAMPLE):
+        """Returns about size trajectories sampled evenly from the shards, drawn from the random module's state."""
+        share = math.ceil(size / len(self.addresses))
+        trajectories = {}
+        for shard in self.broadcast([("sample", share, random.random()) for _ in self.addresses]):
+            trajectories.update(shard)
+
+        return trajectories
+
+    def close(self, stop=False):
+        """Closes the connections, and stops the workers if stop is True."""
+        if stop:
+            self.broadcast(("stop",))
+        for w in range(len(self.addresses)):
+            self._drop(w)
+
+
+def lloyds(coordinator, seed_fn, k, t_max, window=None, slope=None, skipped=None):
+    """Runs Lloyd's algorithm with the approach_2 update on the shards of coordinator.  Returns the k center trajectories and an array of costs for each iteration, as cluster.lloyds.
+
+    Each round broadcasts the centers twice.  The workers first return their partial cost and the size and
+    longest trajectory of each cluster, which fix the length of each new center; they then return the sum
+    of their trajectories of each cluster resampled to that length, and the coordinator divides the total
+    by the size.  Seeding and empty clusters draw from a sample of the shards instead of all trajectories.
+    If skipped is a list, the number of DTW evaluations avoided in each iteration is appended to it.
+    """
+    sample = coordinator.sample()
+    centers = seed_fn(sample, k)
+
+    costs = []
+    for t in range(t_max):
+        arrays = [as_array(center) for center in centers]
+
+        with instrument.span("lloyds.assignment", iteration=t, workers=len(coordinator.addresses)):
+            answers = coordinator.broadcast(("assign", t, arrays, window, slope))
+        costs.append(sum(cost for cost, _, _, _ in answers))
+        if skipped is not None:
+            skipped.append(sum(pruned for _, pruned, _, _ in answers))
+
+        counts = np.sum([counts for _, _, counts, _ in answers], axis=0)
+        lengths = np.max([longest for _, _, _, longest in answers], axis=0)
+
+        with instrument.span("lloyds.update", iteration=t):
+            sums = coordinator.broadcast(("update", t, arrays, window, slope, lengths.tolist()))
+
+            new_centers = []
+            for c in range(len(centers)):
+                if counts[c]:
+                    center = sum(shard[c] for shard in sums if shard[c] is not None) / counts[c]
+                    new_centers.append(list(zip(center[:, 0].tolist(), center[:, 1].tolist())))
+                else:
+                    new_centers.append(seed_fn(sample)[0])
+
+        if new_centers == centers:
+            break
+        centers = new_centers
+
+    return centers, costs
+
+
+if __name__ == "__main__":
+    """Runs a worker node listening on HOST PORT (default localhost 6000), until its coordinator stops it.  The shared secret is read from AUTHKEY_VARIABLE; a worker on localhost makes one up and prints it if it is not set"""
+    host = sys.argv[1] if len(sys.argv) > 1 else "localhost"
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 6000
+
+    authkey = environment_authkey()
+    if authkey is None:
+        if host not in LOCAL_HOSTS:
+            sys.exit(f"A worker listening on {host} needs a shared secret in {AUTHKEY_VARIABLE}")
+        authkey = os.urandom(16).hex().encode()
+        print(f"{AUTHKEY_VARIABLE}={authkey.decode()}", flush=True)
+
+    serve((host, port), authkey)
@@ -0,0 +1,511 @@
+import numpy as np
+
+import instrument
+
+# Moves recorded for the warping path: the predecessor of each cell
+UP, LEFT, DIAG = 0, 1, 2
+
+# Relative tolerance of the early-abandoning test in dtw_kernel
+ABANDON_SLACK = 1e-9
+
+# Default radius of fast_dtw, and the length at or below which it aligns trajectories exactly
+RADIUS = 2
+MIN_SIZE = 64
+
+
+def as_array(trajectory):
+    """Returns the trajectory as an (n, 2) array of floats."""
+    return np.asarray(trajectory, dtype=float).reshape(-1, 2)
+
+
+def band(n, m, window=None, slope=None):
+    """Returns the first and last column each row of the n x m warping matrix may use.
+
+    window is the Sakoe-Chiba radius around the (rescaled) diagonal and slope is the maximum slope of
+    the Itakura parallelogram.  If both are given the band is their intersection.
+    """
+    lo, hi = np.zeros(n), np.full(n, m - 1.0)
+    if n == 1 or m == 1:
+        return lo.astype(int), hi.astype(int)
+
+    x = np.arange(n) / (n - 1)
+    if window is not None:
+        lo = np.maximum(lo, x * (m - 1) - window)
+        hi = np.minimum(hi, x * (m - 1) + window)
+    if slope is not None:
+        lo = np.maximum(lo, np.maximum(x / slope, 1 - slope * (1 - x)) * (m - 1))
+        hi = np.minimum(hi, np.minimum(slope * x, 1 - (1 - x) / slope) * (m - 1))
+
+    lo = np.clip(np.floor(lo), 0, m - 1).astype(int)
+    hi = np.clip(np.ceil(hi), 0, m - 1).astype(int)
+
+    # Widens the band where consecutive rows would otherwise not be connected by a warping step
+    hi[:-1] = np.maximum(hi[:-1], lo[1:] - 1)
+
+    return lo, hi
+
+
+def dtw_kernel(P, Q, path=False, window=None, slope=None, cutoff=None, columns=None):
+    """Returns the size-normalised DTW value and warping size of P and Q, plus the warping path if path is True.
+
+    The recurrence is evaluated one anti-diagonal at a time, since every cell on diagonal i + j only
+    depends on the two previous diagonals.  Without the path only three diagonals are kept in memory.
+    Only the cells inside the band given by window and slope are evaluated.  columns, a pair of arrays of
+    the first and last column each row may use (monotone, as from band or project), replaces the band.
+
+    If cutoff is given, the evaluation stops as soon as the distance (dtw / size)**0.5 is certain to
+    exceed it, and the DTW value returned is inf (with size 1, and no path).
+    """
+    P, Q = as_array(P), as_array(Q)
+    n, m = len(P), len(Q)
+    if columns is None and (window is not None or slope is not None):
+        columns = band(n, m, window, slope)
+
+    diagonals = np.arange(n + m - 1)
+    row_lo, row_hi = np.maximum(0, diagonals - m + 1), np.minimum(n - 1, diagonals)
+    if columns is not None:
+        # The rows of a diagonal inside the columns form one range, since i + lo[i] and i + hi[i] increase with i
+        row_lo = np.maximum(row_lo, np.searchsorted(np.arange(n) + columns[1], diagonals))
+        row_hi = np.minimum(row_hi, np.searchsorted(np.arange(n) + columns[0], diagonals, side="right") - 1)
+    row_lo, row_hi = row_lo.tolist(), row_hi.tolist()
+    if instrument.enabled:
+        instrument.count("dtw.calls")
+        instrument.count("dtw.cells", n * m if columns is None else int(np.sum(np.maximum(columns[1] - columns[0] + 1, 0))))
+
+    # Diagonals are stored by row index, shifted by one so that row -1 is a sentinel
+    dtws = [np.full(n + 2, np.inf) for _ in range(3)]
+    sizes = [np.ones(n + 2) for _ in range(3)]
+
+    # The moves of each diagonal, with the row of its first cell
+    moves = [(0, np.array([DIAG], dtype=np.int8))] if path else None
+
+    dtws[0][1] = (P[0, 0] - Q[0, 0])**2 + (P[0, 1] - Q[0, 1])**2
+    if cutoff is not None:
+        # Slack for the rounding of the running means, so that a distance equal to cutoff is never abandoned
+        limit = cutoff * (1 + ABANDON_SLACK)
+        bound = prev_bound = dtws[0][1]**0.5 / (n + m - 1)
+
+        # The rest of a path from (i, j) visits every later row and column, each no closer than the bounding box of the other trajectory
+        row_rest, col_rest = remaining_costs(P, Q), remaining_costs(Q, P)
+
+    for k in range(1, n + m - 1):
+        cur, prev, prev2 = k % 3, (k - 1) % 3, (k - 2) % 3
+        lo, hi = row_lo[k], row_hi[k]
+        rows = np.arange(lo, hi + 1)
+        cols = k - rows
+
+        distances = (P[rows, 0] - Q[cols, 0])**2 + (P[rows, 1] - Q[cols, 1])**2
+
+        # Predecessors (i - 1, j), (i, j - 1) and (i - 1, j - 1); out-of-range cells read a sentinel
+        up_size, up_dtw = sizes[prev][lo:hi + 1], dtws[prev][lo:hi + 1]
+        left_size, left_dtw = sizes[prev][lo + 1:hi + 2], dtws[prev][lo + 1:hi + 2]
+        diag_size, diag_dtw = sizes[prev2][lo:hi + 1], dtws[prev2][lo:hi + 1]
+
+        up = (distances + up_size * up_dtw) / (up_size + 1)
+        left = (distances + left_size * left_dtw) / (left_size + 1)
+        diag = (distances + diag_size * diag_dtw) / (diag_size + 1)
+        best = np.minimum(np.minimum(up, left), diag)
+
+        # Ties are broken in the same order as the reference implementation: up, left, then diagonal
+        is_up = up == best
+        is_left = ~is_up & (left == best)
+
+        dtws[cur][lo + 1:hi + 2] = best
+        sizes[cur][lo + 1:hi + 2] = np.where(is_up, up_size, np.where(is_left, left_size, diag_size)) + 1
+        dtws[cur][lo], dtws[cur][hi + 2] = np.inf, np.inf
+        sizes[cur][lo], sizes[cur][hi + 2] = 1, 1
+
+        if path:
+            moves.append((lo, np.where(is_up, UP, np.where(is_left, LEFT, DIAG)).astype(np.int8)))
+
+        # The final path goes through a cell of this diagonal or the previous one.  Its sum of squared
+        # distances is at least that of the cell plus the rest, and at most n + m - 2 - k cells follow the cell.
+        if cutoff is not None:
+            new_sizes = sizes[cur][lo + 1:hi + 2]
+            totals = best * new_sizes + np.maximum(row_rest[rows], col_rest[cols])
+            bound, prev_bound = float(np.min(np.sqrt(totals) / (new_sizes + (n + m - 2 - k)), initial=np.inf)), bound
+            if bound > limit and prev_bound > limit:
+                if instrument.enabled:
+                    instrument.count("dtw.abandoned")
+                return (np.inf, 1, None) if path else (np.inf, 1)
+
+    last = (n + m - 2) % 3
+    dtw, size = float(dtws[last][n]), int(sizes[last][n])
+
+    if not path:
+        return dtw, size
+
+    return dtw, size, trace_path(moves)
+
+
+def dtw_batch(Ps, Qs, window=None, slope=None, cutoff=None, nearest=False):
+    """Returns the DTW values and warping sizes of the pairs (Ps[c], Qs[c]), as two arrays, the same as dtw_kernel on each pair.
+
+    The pairs are padded into stacked arrays and the recurrence advances all of them one anti-diagonal at
+    a time, so the cost of each numpy call is shared by every pair.  cutoff, a number or one per pair,
+    abandons pairs like dtw_kernel does, with inf as their DTW value.  If nearest is True only the
+    smallest distance matters, and every pair is also abandoned once it cannot beat a pair already done.
+    """
+    Ps, Qs = [as_array(P) for P in Ps], [as_array(Q) for Q in Qs]
+    count = len(Ps)
+    ns, ms = np.array([len(P) for P in Ps], dtype=int), np.array([len(Q) for Q in Qs], dtype=int)
+    dtw_out, size_out = np.full(count, np.inf), np.ones(count, dtype=int)
+    if count == 0:
+        return dtw_out, size_out
+    if instrument.enabled:
+        instrument.count("dtw.calls", count)
+        instrument.count("dtw.cells", int(np.sum(ns * ms)))
+
+    N, M = int(ns.max()), int(ms.max())
+    P_stack, Q_stack = np.zeros((count, N, 2)), np.zeros((count, M, 2))
+    for c in range(count):
+        P_stack[c, :ns[c]] = Ps[c]
+        Q_stack[c, :ms[c]] = Qs[c]
+
+    # Columns each row may use; rows past the end of P use none
+    band_lo, band_hi = np.full((count, N), M), np.full((count, N), -1)
+    for c in range(count):
+        band_lo[c, :ns[c]], band_hi[c, :ns[c]] = band(ns[c], ms[c], window, slope)
+
+    # Pairs that are still running, and the diagonal of their last cell
+    active = np.arange(count)
+    last_k = ns + ms - 2
+
+    dtws = [np.full((count, N + 2), np.inf) for _ in range(3)]
+    sizes = [np.ones((count, N + 2)) for _ in range(3)]
+    # The same expression as every other cell and as dtw_kernel, so results agree to the last bit
+    dtws[0][:, 1] = (P_stack[:, 0, 0] - Q_stack[:, 0, 0])**2 + (P_stack[:, 0, 1] - Q_stack[:, 0, 1])**2
+
+    # Pairs of single points are done before the first diagonal
+    alive = last_k > 0
+    dtw_out[~alive], size_out[~alive] = dtws[0][~alive, 1], 1
+
+    bounded = cutoff is not None or nearest
+    if bounded:
+        limits = np.full(count, np.inf) if cutoff is None else np.broadcast_to(np.asarray(cutoff, dtype=float) * (1 + ABANDON_SLACK), (count,)).copy()
+        if nearest and not alive.all():
+            limits = np.minimum(limits, float(np.sqrt(dtw_out[~alive]).min()) * (1 + ABANDON_SLACK))
+        bounds = np.sqrt(dtws[0][:, 1]) / (ns + ms - 1)
+        row_rest, col_rest = np.zeros((count, N)), np.zeros((count, M))
+        for c in range(count):
+            row_rest[c, :ns[c]] = remaining_costs(Ps[c], Qs[c])
+            col_rest[c, :ms[c]] = remaining_costs(Qs[c], Ps[c])
+
+    for k in range(1, int(last_k.max()) + 1):
+        # Pairs that are done are dropped once they are a quarter of the stack
+        if (~alive).sum() * 4 >= len(active) and alive.any():
+            keep = alive
+            active, last_k, ns, ms = active[keep], last_k[keep], ns[keep], ms[keep]
+            P_stack, Q_stack, band_lo, band_hi = P_stack[keep], Q_stack[keep], band_lo[keep], band_hi[keep]
+            dtws = [d[keep] for d in dtws]
+            sizes = [s[keep] for s in sizes]
+            if bounded:
+                row_rest, col_rest, bounds, limits = row_rest[keep], col_rest[keep], bounds[keep], limits[keep]
+            alive = alive[keep]
+        elif not alive.any():
+            break
+
+        cur, prev, prev2 = k % 3, (k - 1) % 3, (k - 2) % 3
+        lo, hi = max(0, k - M + 1), min(N - 1, k)
+        rows = np.arange(lo, hi + 1)
+        cols = k - rows
+
+        distances = (P_stack[:, rows, 0] - Q_stack[:, cols, 0])**2 + (P_stack[:, rows, 1] - Q_stack[:, cols, 1])**2
+
+        # Predecessors (i - 1, j), (i, j - 1) and (i - 1, j - 1); out-of-range cells read a sentinel
+        up_size, up_dtw = sizes[prev][:, lo:hi + 1], dtws[prev][:, lo:hi + 1]
+        left_size, left_dtw = sizes[prev][:, lo + 1:hi + 2], dtws[prev][:, lo + 1:hi + 2]
+        diag_size, diag_dtw = sizes[prev2][:, lo:hi + 1], dtws[prev2][:, lo:hi + 1]
+
+        up = (distances + up_size * up_dtw) / (up_size + 1)
+        left = (distances + left_size * left_dtw) / (left_size + 1)
+        diag = (distances + diag_size * diag_dtw) / (diag_size + 1)
+        best = np.minimum(np.minimum(up, left), diag)
+
+        # Ties are broken in the same order as the reference implementation: up, left, then diagonal
+        is_up = up == best
+        is_left = ~is_up & (left == best)
+
+        # Cells outside the band, or past the end of either trajectory of the pair, are unreachable
+        best = np.where((cols >= band_lo[:, rows]) & (cols <= band_hi[:, rows]) & (cols < ms[:, None]), best, np.inf)
+
+        dtws[cur][:, lo + 1:hi + 2] = best
+        sizes[cur][:, lo + 1:hi + 2] = np.where(is_up, up_size, np.where(is_left, left_size, diag_size)) + 1
+        dtws[cur][:, lo], dtws[cur][:, hi + 2] = np.inf, np.inf
+        sizes[cur][:, lo], sizes[cur][:, hi + 2] = 1, 1
+
+        done = alive & (last_k == k)
+        if done.any():
+            finished = active[done]
+            dtw_out[finished] = dtws[cur][done, ns[done]]
+            size_out[finished] = sizes[cur][done, ns[done]].astype(int)
+            alive &= ~done
+            if nearest:
+                distances_done = np.sqrt(dtw_out[finished] / size_out[finished])
+                limits = np.minimum(limits, float(distances_done.min()) * (1 + ABANDON_SLACK))
+
+        # The same bound as dtw_kernel, for every pair at once; pairs that are done may read past their last cell
+        if bounded:
+            new_sizes = sizes[cur][:, lo + 1:hi + 2]
+            totals = best * new_sizes + np.maximum(row_rest[:, rows], col_rest[:, cols])
+            bounds, prev_bounds = np.min(np.sqrt(totals) / (new_sizes + np.maximum(last_k - k, 0)[:, None]), axis=1), bounds
+            abandoned = alive & (bounds > limits) & (prev_bounds > limits)
+            if abandoned.any():
+                if instrument.enabled:
+                    instrument.count("dtw.abandoned", int(abandoned.sum()))
+                alive &= ~abandoned
+
+    return dtw_out, size_out
+
+
+def remaining_costs(P, Q):
+    """Returns, for each point of P, the sum of the squared distances of the later points of P to the bounding box of Q."""
+    lo, hi = Q.min(axis=0), Q.max(axis=0)
+    gaps = np.maximum(lo - P, 0) + np.maximum(P - hi, 0)
+    costs = (gaps**2).sum(axis=1)
+
+    return np.concatenate((np.cumsum(costs[::-1])[::-1][1:], [0.0]))
+
+
+def trace_path(moves):
+    """Returns the warping path encoded by moves, the moves of each diagonal with its first row, from the last cell back to (0, 0)."""
+    path = []
+    i = moves[-1][0]
+    j = len(moves) - 1 - i
+    while i > 0 or j > 0:
+        path.append((i, j))
+        first, diagonal = moves[i + j]
+        move = diagonal[i - first]
+        if i == 0:
+            j -= 1
+        elif j == 0:
+            i -= 1
+        elif move == UP:
+            i -= 1
+        elif move == LEFT:
+            j -= 1
+        else:
+            i -= 1
+            j -= 1
+    path.append((0, 0))
+
+    return path
+
+
+def band_kernel(P, Q, columns, path=False, cutoff=None):
+    """Returns dtw_kernel(P, Q, path, cutoff=cutoff, columns=columns), with the same values and path, for bands only a few cells wide.
+
+    The cells are evaluated one row at a time in plain Python, so the cost is linear in the number of
+    cells in the band.  dtw_kernel pays for a dozen numpy calls on each of the n + m - 1 diagonals however
+    few cells they hold, which dominates in the narrow windows of fast_dtw.  Only two rows are kept in
+    memory, plus the moves of the band if path is True.  With a cutoff every row is checked, since the
+    path visits each of them, with the same bound as dtw_kernel.
+    """
+    P, Q = as_array(P), as_array(Q)
+    n, m = len(P), len(Q)
+    row_lo, row_hi = columns[0].tolist(), columns[1].tolist()
+    Px, Py, Qx, Qy = P[:, 0].tolist(), P[:, 1].tolist(), Q[:, 0].tolist(), Q[:, 1].tolist()
+    if instrument.enabled:
+        instrument.count("dtw.calls")
+        instrument.count("dtw.cells", int(np.sum(np.maximum(columns[1] - columns[0] + 1, 0))))
+
+    inf = float("inf")
+    if cutoff is not None:
+        limit = cutoff * (1 + ABANDON_SLACK)
+        row_rest, col_rest = remaining_costs(P, Q).tolist(), remaining_costs(Q, P).tolist()
+
+    # The previous row, over its columns prev_lo to prev_hi; row -1 has none
+    prev_lo, prev_hi, prev_dtws, prev_sizes = 0, -1, [], []
+    moves = [] if path else None
+
+    for i in range(n):
+        lo, hi = row_lo[i], row_hi[i]
+        x, y = Px[i], Py[i]
+        dtws, sizes = [inf] * (hi - lo + 1), [1] * (hi - lo + 1)
+        row_moves = bytearray(hi - lo + 1) if path else None
+        bound = inf
+
+        for j in range(lo, hi + 1):
+            # Squared by multiplication, as numpy squares arrays; Python's pow can round differently
+            dx, dy = x - Qx[j], y - Qy[j]
+            distance = dx * dx + dy * dy
+
+            # Predecessors outside the band read the same sentinel as in dtw_kernel
+            up_dtw, up_size = (prev_dtws[j - prev_lo], prev_sizes[j - prev_lo]) if prev_lo <= j <= prev_hi else (inf, 1)
+            left_dtw, left_size = (dtws[j - 1 - lo], sizes[j - 1 - lo]) if j > lo else (inf, 1)
+            diag_dtw, diag_size = (prev_dtws[j - 1 - prev_lo], prev_sizes[j - 1 - prev_lo]) if prev_lo < j <= prev_hi + 1 else (inf, 1)
+
+            up = (distance + up_size * up_dtw) / (up_size + 1)
+            left = (distance + left_size * left_dtw) / (left_size + 1)
+            diag = (distance + diag_size * diag_dtw) / (diag_size + 1)
+            best = min(up, left, diag)
+
+            # Ties are broken in the same order as the reference implementation: up, left, then diagonal
+            if i == 0 and j == 0:
+                best, size, move = distance, 1, DIAG
+            elif up == best:
+                size, move = up_size + 1, UP
+            elif left == best:
+                size, move = left_size + 1, LEFT
+            else:
+                size, move = diag_size + 1, DIAG
+            dtws[j - lo], sizes[j - lo] = best, size
+            if path:
+                row_moves[j - lo] = move
+
+            if cutoff is not None:
+                bound = min(bound, (best * size + max(row_rest[i], col_rest[j]))**0.5 / (size + n + m - 2 - i - j))
+
+        if cutoff is not None and bound > limit:
+            if instrument.enabled:
+                instrument.count("dtw.abandoned")
+            return (np.inf, 1, None) if path else (np.inf, 1)
+
+        if path:
+            moves.append((lo, row_moves))
+        prev_lo, prev_hi, prev_dtws, prev_sizes = lo, hi, dtws, sizes
+
+    dtw, size = float(prev_dtws[m - 1 - prev_lo]), int(prev_sizes[m - 1 - prev_lo])
+
+    if not path:
+        return dtw, size
+
+    return dtw, size, trace_rows(moves, m)
+
+
+def trace_rows(moves, m):
+    """Returns the warping path encoded by moves, the moves of each row with its first column, from the last cell back to (0, 0)."""
+    path = []
+    i, j = len(moves) - 1, m - 1
+    while i > 0 or j > 0:
+        path.append((i, j))
+        first, row = moves[i]
+        move = row[j - first]
+        if i == 0:
+            j -= 1
+        elif j == 0:
+            i -= 1
+        elif move == UP:
+            i -= 1
+        elif move == LEFT:
+            j -= 1
+        else:
+            i -= 1
+            j -= 1
+    path.append((0, 0))
+
+    return path
+
+
+def fast_dtw(P, Q, radius=RADIUS, path=False, cutoff=None):
+    """Returns an approximation of dtw_kernel(P, Q, path, cutoff=cutoff) in time and memory linear in the lengths, for a fixed radius (FastDTW).
+
+    Both trajectories are halved, by averaging consecutive points, until one has at most MIN_SIZE points
+    and is aligned exactly.  The warping path found at each resolution is projected onto the next finer
+    one and widened by radius cells, and band_kernel evaluates the recurrence only in that window.  The
+    result is approximate, above or below dtw_kernel, since the size-normalised recurrence picks each
+    predecessor greedily and the window can change that choice even on the exact path; no radius makes
+    it exact.  On random walks of 300 to 6000 points, radius 1 is typically 1-4% off (at worst 8%) and
+    2-3x faster than dtw_kernel at 300 points, 9-10x at 6000.  Radius 4 is typically 0-2% off (at worst
+    7%) and 1.2-4.5x faster; radius 16 is no faster than exact DTW.  align.compare_fast reports both
+    for a given pair.
+    """
+    P, Q = as_array(P), as_array(Q)
+    n, m = len(P), len(Q)
+    if n <= MIN_SIZE or m <= MIN_SIZE:
+        return dtw_kernel(P, Q, path, cutoff=cutoff)
+
+    _, _, coarse_path = fast_dtw(coarsen(P), coarsen(Q), radius, path=True)
+
+    return band_kernel(P, Q, project(coarse_path, n, m, radius), path, cutoff)
+
+
+def coarsen(P):
+    """Returns P at half the resolution: the mean of each pair of consecutive points, and the last point if n is odd."""
+    half = len(P) // 2
+    coarse = (P[:2 * half:2] + P[1:2 * half:2]) / 2
+    if len(P) % 2:
+        coarse = np.vstack((coarse, P[-1:]))
+
+    return coarse
+
+
+def project(path, n, m, radius):
+    """Returns the first and last column each of n rows may use: the cells of a path at half the resolution, widened by radius cells."""
+    cells = np.array(path)
+
+    # Cell (i, j) of the coarse path covers rows 2i and 2i + 1 and columns 2j and 2j + 1
+    rows = np.minimum(np.concatenate((2 * cells[:, 0], 2 * cells[:, 0] + 1)), n - 1)
+    cols = np.concatenate((2 * cells[:, 1], 2 * cells[:, 1]))
+    lo, hi = np.full(n, m - 1), np.zeros(n, dtype=int)
+    np.minimum.at(lo, rows, cols)
+    np.maximum.at(hi, rows, np.minimum(cols + 1, m - 1))
+
+    # Widens the window by radius rows up and down, then by radius columns
+    wide_lo, wide_hi = lo.copy(), hi.copy()
+    for shift in range(1, min(radius, n - 1) + 1):
+        wide_lo[shift:] = np.minimum(wide_lo[shift:], lo[:-shift])
+        wide_lo[:-shift] = np.minimum(wide_lo[:-shift], lo[shift:])
+        wide_hi[shift:] = np.maximum(wide_hi[shift:], hi[:-shift])
+        wide_hi[:-shift] = np.maximum(wide_hi[:-shift], hi[shift:])
+
+    return np.maximum(wide_lo - radius, 0), np.minimum(wide_hi + radius, m - 1)
+
+
+def lb_kim(P, Q):
+    """Returns a lower bound on the DTW distance of P and Q from their endpoints, which every warping path visits."""
+    P, Q = as_array(P), as_array(Q)
+    n, m = len(P), len(Q)
+
+    total = (P[0, 0] - Q[0, 0])**2 + (P[0, 1] - Q[0, 1])**2
+    if n > 1 or m > 1:
+        total += (P[-1, 0] - Q[-1, 0])**2 + (P[-1, 1] - Q[-1, 1])**2
+
+    # A warping path visits at most n + m - 1 cells
+    return total**0.5 / (n + m - 1)
+
+
+def envelope(Q, n, window=None, slope=None):
+    """Returns the bounding box (xmin, ymin, xmax, ymax) of the points of Q that each of n rows may be warped onto."""
+    Q = as_array(Q)
+
+    if window is None and slope is None:
+        return np.concatenate((Q.min(axis=0), Q.max(axis=0)))[None, :]
+
+    lo, hi = band(n, len(Q), window, slope)
+    boxes = np.empty((n, 4))
+    for i in range(n):
+        block = Q[lo[i]:hi[i] + 1]
+        boxes[i, :2] = block.min(axis=0)
+        boxes[i, 2:] = block.max(axis=0)
+
+    return boxes
+
+
+def lb_keogh(P, boxes, m):
+    """Returns a lower bound on the DTW distance of P and a trajectory of m points with the given envelope."""
+    P = as_array(P)
+
+    # Every row of the warping matrix is visited at least once, at a point no closer than its envelope
+    dx = np.maximum(boxes[:, 0] - P[:, 0], 0) + np.maximum(P[:, 0] - boxes[:, 2], 0)
+    dy = np.maximum(boxes[:, 1] - P[:, 1], 0) + np.maximum(P[:, 1] - boxes[:, 3], 0)
+
+    return float(np.sum(dx**2 + dy**2))**0.5 / (len(P) + m - 1)
+
+
+if __name__ == "__main__":
+    """Checks on random trajectories that dtw_batch returns bit for bit the values and sizes of dtw_kernel"""
+    TRIALS = 300
+    rng = np.random.default_rng(0)
+
+    for trial in range(TRIALS):
+        window, slope = [(None, None), (2, None), (None, 2.0)][trial % 3]
+        Q = rng.integers(-20, 20, size=(int(rng.integers(1, 30)), 2)).astype(float)
+        Ps = [rng.normal(scale=10, size=(int(rng.integers(1, 30)), 2)) for _ in range(4)] + [rng.integers(-20, 20, size=(int(rng.integers(1, 30)), 2)).astype(float)]
+
+        dtws, sizes = dtw_batch(Ps, [Q] * len(Ps), window, slope)
+        for P, dtw, size in zip(Ps, dtws.tolist(), sizes.tolist()):
+            expected = dtw_kernel(P, Q, window=window, slope=slope)
+            assert (dtw, size) == expected, f"dtw_batch gives {(dtw, size)}, dtw_kernel {expected}"
+
+    print(f"dtw_batch agrees bit for bit with dtw_kernel on {TRIALS} random batches")
@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import threading
+from contextlib import nullcontext
+
+# Instrumentation is off by default; hot paths check this flag before doing any work.  Worker processes
+# record into their own copy of this module: the pools of cluster.lloyds and pairwise.pairwise_distances
+# enable it in their workers and hand the counters back with take_counters, but the timers and values of
+# worker processes, the counters of distributed.py workers and anything done by plotting workers are lost.
+enabled = False
+
+_counters = {}
+_timers = {}
+_values = {}
+_events = []
+_origin = time.perf_counter()
+_disabled_span = nullcontext()
+
+
+def enable():
+    """Turns instrumentation on."""
+    global enabled
+    enabled = True
+
+
+def disable():
+    """Turns instrumentation off.  Recorded data is kept until reset."""
+    global enabled
+    enabled = False
+
+
+def reset():
+    """Discards all recorded data."""
+    global _origin
+    _counters.clear()
+    _timers.clear()
+    _values.clear()
+    _events.clear()
+    _origin = time.perf_counter()
+
+
+def count(name, amount=1):
+    """Adds amount to the counter name."""
+    if enabled:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def take_counters():
+    """Returns the counters and clears them, for a worker process to hand its counts to merge_counters in the parent."""
+    counters = dict(_counters)
+    _counters.clear()
+    return counters
+
+
+def merge_counters(counters):
+    """Adds counters, e.g. from take_counters in a worker process, to the counters of this process."""
+    for name, amount in counters.items():
+        count(name, amount)
+
+
+def record(name, value):
+    """Records one sample of the value name, e.g. a compression ratio."""
+    if enabled:
+        _summarize(_values, name, value)
+
+
+def span(name, **args):
+    """Returns a context manager that times its block under name, and adds it to the trace with args."""
+    if not enabled:
+        return _disabled_span
+    return _Span(name, args)
+
+
+class _Span:
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        _summarize(_timers, self.name, end - self.start)
+        _events.append({
+            "name": self.name,
+            "ph": "X",
+            "ts": (self.start - _origin) * 1e6,
+            "dur": (end - self.start) * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": self.args,
+        })
+        return False
+
+
+def _summarize(summaries, name, value):
+    summary = summaries.get(name)
+    if summary is None:
+        summaries[name] = {"count": 1, "total": value, "min": value, "max": value}
+    else:
+        summary["count"] += 1
+        summary["total"] += value
+        summary["min"] = min(summary["min"], value)
+        summary["max"] = max(summary["max"], value)
+
+
+def metrics():
+    """Returns the counters, timers (in seconds) and recorded values as a dict."""
+    def with_mean(summaries):
+        return {name : dict(summary, mean=summary["total"] / summary["count"]) for name, summary in summaries.items()}
+
+    return {"counters": dict(_counters), "timers": with_mean(_timers), "values": with_mean(_values)}
+
+
+def export_metrics(path):
+    """Writes the metrics to path as JSON."""
+    with open(path, "w") as file:
+        json.dump(metrics(), file, indent=2)
+
+
+def export_trace(path):
+    """Writes the timed spans to path in the Chrome trace event format (chrome://tracing, Perfetto)."""
+    with open(path, "w") as file:
+        json.dump({"traceEvents": _events, "displayTimeUnit": "ms"}, file)
@@ -0,0 +1,147 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+import instrument
+from dtw import as_array
+from utils import dtw_distance
+
+# Trajectories and distance function of a worker process, set once by the pool initializer
+_shared = {}
+
+
+class DistanceMatrix:
+    """Matrix of distances between trajectories, indexed by trajectory id.  Row i holds the distances from trajectory i to the others."""
+
+    def __init__(self, tids, matrix):
+        self.tids = list(tids)
+        self.matrix = matrix
+        self.positions = {tid : i for i, tid in enumerate(self.tids)}
+
+    def __getitem__(self, pair):
+        tid, tid2 = pair
+        return float(self.matrix[self.positions[tid], self.positions[tid2]])
+
+    def medoid(self, tids=None):
+        """Returns the id among tids (all ids by default) with the smallest total distance to the others."""
+        tids = self.tids if tids is None else list(tids)
+        rows = [self.positions[tid] for tid in tids]
+
+        # cumsum adds left to right, like a running total, so ties resolve as in a plain loop
+        totals = self.matrix[np.ix_(rows, rows)].cumsum(axis=1)[:, -1]
+
+        return tids[int(np.argmin(totals))]
+
+    def center(self, trajectories):
+        """Returns the medoid of the trajectories, a dict of trajectory ids to trajectories."""
+        return trajectories[self.medoid(trajectories.keys())]
+
+
+def _init_worker(trajectories, distance, instrumented):
+    if instrumented:
+        instrument.enable()
+    _shared["trajectories"] = trajectories
+    _shared["distance"] = distance
+
+
+def _compute_pairs(pairs):
+    trajectories, distance = _shared["trajectories"], _shared["distance"]
+    return [distance(trajectories[i], trajectories[j]) for i, j in pairs], instrument.take_counters()
+
+
+def pairwise_distances(trajectories, distance=dtw_distance, workers=None, symmetric=True):
+    """Returns the DistanceMatrix of the trajectories, a dict of trajectory ids to trajectories.
+
+    With symmetric, only the upper triangle is computed and mirrored.  dtw_distance is not symmetric: its
+    recurrence breaks ties between predecessors in a fixed order, so dtw(P, Q) and dtw(Q, P) can differ,
+    by over 10% on points of an integer grid.  The mirrored matrix therefore redefines the distance of
+    (Q, P) as that of (P, Q), at half the cost; symmetric=False computes both orientations instead.  The
+    pairs are split into chunks over a pool of workers processes (os.cpu_count() by default); the
+    trajectories are sent to each worker once, when it starts.
+    """
+    tids = list(trajectories.keys())
+    arrays = [as_array(trajectories[tid]) for tid in tids]
+    n = len(tids)
+
+    if symmetric:
+        rows, cols = np.triu_indices(n, 1)
+    else:
+        rows, cols = np.nonzero(~np.eye(n, dtype=bool))
+    pairs = list(zip(rows.tolist(), cols.tolist()))
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(pairs) < 2 * workers:
+        values = [distance(arrays[i], arrays[j]) for i, j in pairs]
+    else:
+        size = -(-len(pairs) // (4 * workers))
+        chunks = [pairs[i:i + size] for i in range(0, len(pairs), size)]
+        values = []
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(arrays, distance, instrument.enabled)) as pool:
+            for chunk, counters in pool.map(_compute_pairs, chunks):
+                values += chunk
+                instrument.merge_counters(counters)
+
+    matrix = np.zeros((n, n))
+    if symmetric:
+        matrix[cols, rows] = values
+    matrix[rows, cols] = values
+
+    return DistanceMatrix(tids, matrix)
+
+
+def medoid(trajectories, distance=dtw_distance, symmetric=True):
+    """Returns the id of the trajectory with the smallest total distance to the others, the same as the DistanceMatrix.medoid of pairwise_distances(trajectories, distance, symmetric=symmetric).
+
+    Totals are summed one trajectory at a time, and unknown distances are bounded from below by the
+    endpoints (LB_Kim), which holds in either orientation.  A total is abandoned as soon as what it has
+    summed plus the bounds of what is left exceeds the best total so far, and each distance gets the
+    remaining slack as its cutoff.  distance must take a cutoff and return inf when it is exceeded.  With
+    symmetric, distances computed in full are also used for the mirrored pair.
+    """
+    tids = list(trajectories.keys())
+    arrays = [as_array(trajectories[tid]) for tid in tids]
+    n = len(tids)
+
+    # Exact distances where known, LB_Kim elsewhere; every warping path matches the first and last points
+    firsts = np.array([array[0] for array in arrays]).reshape(-1, 2)
+    lasts = np.array([array[-1] for array in arrays]).reshape(-1, 2)
+    lengths = np.array([len(array) for array in arrays])
+    ends = ((firsts[:, None] - firsts[None, :])**2).sum(axis=2)
+    ends += np.where((lengths[:, None] > 1) | (lengths[None, :] > 1), ((lasts[:, None] - lasts[None, :])**2).sum(axis=2), 0)
+    bounds = np.sqrt(ends) / (lengths[:, None] + lengths[None, :] - 1)
+    np.fill_diagonal(bounds, 0)
+    known = np.zeros((n, n), dtype=bool)
+
+    # Trajectories with the smallest bounded totals are summed first, so the best total drops quickly
+    order = np.argsort(bounds.sum(axis=1), kind="stable").tolist()
+
+    best, best_total = 0, float("inf")
+    for i in order:
+        # Columns are added in order, like the row sums of the full matrix, so the totals are identical
+        total = 0.0
+        rest = float(bounds[i].sum())
+        for j in range(n):
+            if j == i:
+                continue
+            rest -= bounds[i, j]
+            if total + bounds[i, j] + rest > best_total:
+                break
+
+            # The pair is always computed in the same orientation as in pairwise_distances
+            a, b = (min(i, j), max(i, j)) if symmetric else (i, j)
+            if not known[a, b]:
+                cutoff = best_total - total - rest if best_total < float("inf") else None
+                dist = distance(arrays[a], arrays[b], cutoff=cutoff)
+                if dist == float("inf"):
+                    break
+                bounds[a, b] = dist
+                if symmetric:
+                    bounds[b, a] = dist
+                known[a, b] = True
+            total += bounds[i, j]
+        else:
+            # Ties go to the first trajectory, as with argmin
+            if total < best_total or (total == best_total and i < best):
+                best, best_total = i, total
+
+    return tids[best]
@@ -0,0 +1,162 @@
+import heapq
+import time
+import numpy as np
+
+import instrument
+from dtw import as_array, envelope, lb_keogh
+from store import load
+from utils import dtw_distance
+
+# Number of (candidate, query point) pairs evaluated at once by the bounding-box bound
+BLOCK_SIZE = 250000
+
+
+class SimilarityIndex:
+    """Answers exact top-k DTW queries over a collection of trajectories.
+
+    Every trajectory is summarised once by its endpoints, length and bounding box.  A query ranks the
+    candidates by lower bounds of increasing cost: first the endpoints (LB_Kim, for all candidates at
+    once), then the distance of the query to each bounding box, then the distance of the candidate to the
+    envelope of the query (LB_Keogh).  DTW is only computed for candidates that survive, in order of their
+    bounds, and abandons as soon as the candidate cannot beat the current k-th best distance.
+    """
+
+    def __init__(self, trajectories, window=None, slope=None):
+        self.tids = list(trajectories.keys())
+        self.arrays = [as_array(trajectories[tid]) for tid in self.tids]
+        self.window = window
+        self.slope = slope
+
+        self.lengths = np.array([len(array) for array in self.arrays])
+        self.firsts = np.array([array[0] for array in self.arrays]).reshape(-1, 2)
+        self.lasts = np.array([array[-1] for array in self.arrays]).reshape(-1, 2)
+        self.boxes = np.array([np.concatenate((array.min(axis=0), array.max(axis=0))) for array in self.arrays]).reshape(-1, 4)
+
+        self.queries = 0
+        self.seconds = 0.0
+        self.pruned = {"kim": 0, "box": 0, "keogh": 0, "abandoned": 0}
+        self.computed = 0
+
+    @classmethod
+    def from_store(cls, store, tids=None, window=None, slope=None):
+        """Returns the index of the trajectories tids (all by default) of a TrajectoryStore, without copying their points."""
+        tids = store.index.keys() if tids is None else tids
+        return cls({tid : store[tid] for tid in tids if tid in store}, window, slope)
+
+    @classmethod
+    def from_csv(cls, csv_path, tids=None, window=None, slope=None):
+        return cls.from_store(load(csv_path), tids, window, slope)
+
+    def __len__(self):
+        return len(self.tids)
+
+    def query(self, Q, k=10, exclude=()):
+        """Returns the k trajectories closest to Q in DTW distance, as (distance, tid) pairs from closest to farthest.
+
+        Trajectory ids in exclude, e.g. the query itself, are skipped.  Candidates tied with the k-th
+        distance may be left out.
+        """
+        start = time.perf_counter()
+        Q = as_array(Q)
+        m = len(Q)
+        sizes = self.lengths + m - 1
+
+        with instrument.span("search.query", candidates = len(self), k = k):
+            # Every warping path matches the first points and the last points
+            kim = ((self.firsts - Q[0])**2).sum(axis=1)
+            kim += np.where((self.lengths > 1) | (m > 1), ((self.lasts - Q[-1])**2).sum(axis=1), 0)
+            bounds = np.sqrt(kim) / sizes
+
+            # Candidates are visited in order of their bounds, so the k-th best distance drops quickly
+            candidates = [c for c in np.argsort(bounds, kind="stable").tolist() if self.tids[c] not in exclude]
+            best = []
+
+            for visited, (c, bound, box_bound) in enumerate(self._ranked(candidates, Q, bounds, sizes)):
+                # The candidates left have no smaller endpoint bound
+                if len(best) == k and bound >= -best[0][0]:
+                    self.pruned["kim"] += len(candidates) - visited
+                    break
+                self._visit(c, Q, box_bound, k, best)
+
+        self.queries += 1
+        self.seconds += time.perf_counter() - start
+        if instrument.enabled:
+            instrument.count("search.queries")
+
+        return [(-distance, self.tids[c]) for distance, c in sorted(best, reverse=True)]
+
+    def _ranked(self, candidates, Q, bounds, sizes):
+        """Yields each candidate with its endpoint bound and its bounding-box bound, computed a block of candidates at a time."""
+        step = max(1, BLOCK_SIZE // len(Q))
+        for position in range(0, len(candidates), step):
+            block = candidates[position:position + step]
+
+            # Every point of Q is matched to a point of the candidate, so no closer than its bounding box
+            boxes = self.boxes[block]
+            dx = np.maximum(boxes[:, None, 0] - Q[None, :, 0], 0) + np.maximum(Q[None, :, 0] - boxes[:, None, 2], 0)
+            dy = np.maximum(boxes[:, None, 1] - Q[None, :, 1], 0) + np.maximum(Q[None, :, 1] - boxes[:, None, 3], 0)
+            box_bounds = np.maximum(np.sqrt((dx**2 + dy**2).sum(axis=1)) / sizes[block], bounds[block])
+
+            yield from zip(block, bounds[block].tolist(), box_bounds.tolist())
+
+    def _visit(self, c, Q, bound, k, best):
+        """Adds candidate c to the max-heap best of (-distance, c) if it is among the k closest so far."""
+        if len(best) == k and bound >= -best[0][0]:
+            self.pruned["box"] += 1
+            return
+
+        P = self.arrays[c]
+        if len(best) == k:
+            # Every point of the candidate is matched to a point of Q within its envelope
+            if lb_keogh(P, envelope(Q, len(P), self.window, self.slope), len(Q)) >= -best[0][0]:
+                self.pruned["keogh"] += 1
+                return
+
+        cutoff = -best[0][0] if len(best) == k else None
+        distance = dtw_distance(P, Q, self.window, self.slope, cutoff)
+        self.computed += 1
+
+        if distance == np.inf:
+            self.pruned["abandoned"] += 1
+        elif len(best) < k:
+            heapq.heappush(best, (-distance, c))
+        elif distance < -best[0][0]:
+            heapq.heapreplace(best, (-distance, c))
+
+    def search(self, queries, k=10, exclude_self=True):
+        """Runs query for every (tid, trajectory) of queries.  Returns a dict of query ids to their results.  With exclude_self, a query never matches its own id."""
+        return {tid : self.query(Q, k, (tid,) if exclude_self else ()) for tid, Q in queries.items()}
+
+    def stats(self):
+        """Returns the number of queries and their throughput, and how many candidates each stage of the cascade removed."""
+        return {
+            "queries": self.queries,
+            "queries_per_second": self.queries / self.seconds if self.seconds > 0 else 0.0,
+            "pruned": dict(self.pruned),
+            "dtw_computed": self.computed,
+        }
+
+
+def brute_force(Q, trajectories, k=10, exclude=(), window=None, slope=None):
+    """Returns the k trajectories closest to Q by computing every DTW distance, as a check of SimilarityIndex."""
+    distances = []
+    for tid, P in trajectories.items():
+        if tid not in exclude:
+            distances.append((dtw_distance(P, Q, window, slope), tid))
+
+    return sorted(distances)[:k]
+
+
+if __name__ == "__main__":
+    """Finds the 10 trajectories most similar to a sample of trajectories, and reports the throughput"""
+    QUERIES = 20
+    K = 10
+
+    index = SimilarityIndex.from_csv("data/geolife-cars-upd8.csv")
+    queries = {tid : index.arrays[i] for i, tid in enumerate(index.tids[:QUERIES])}
+
+    results = index.search(queries, K)
+    for tid, result in results.items():
+        print(f"{tid}: {[(round(distance, 6), match) for distance, match in result]}")
+
+    print(f"Search: {index.stats()}")
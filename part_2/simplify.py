@@ -0,0 +1,95 @@
+import numpy as np
+
+
+def segment_distances(points, a, b):
+    """Returns the distance between each of the points and its projection onto the line segment from a to b."""
+    to_a = np.sqrt((points[:, 0] - a[0])**2 + (points[:, 1] - a[1])**2)
+    segment_length_squared = (a[0] - b[0])**2 + (a[1] - b[1])**2
+
+    if segment_length_squared == 0:
+        return to_a
+
+    to_b = np.sqrt((points[:, 0] - b[0])**2 + (points[:, 1] - b[1])**2)
+    t = ((points[:, 0] - a[0]) * (b[0] - a[0]) + (points[:, 1] - a[1]) * (b[1] - a[1])) / segment_length_squared
+    closest_x = a[0] + t * (b[0] - a[0])
+    closest_y = a[1] + t * (b[1] - a[1])
+    to_closest = np.sqrt((points[:, 0] - closest_x)**2 + (points[:, 1] - closest_y)**2)
+
+    return np.where(t < 0, to_a, np.where(t > 1, to_b, to_closest))
+
+
+def greedy_indices(T, epsilon):
+    """Returns the indices of the points kept by the epsilon-simplification of T.
+
+    Segments still to be examined are kept on an explicit stack of (start, end) indices, so no slices of T
+    are copied and long trajectories cannot hit the recursion limit.
+    """
+    T = np.asarray(T, dtype=float).reshape(-1, 2)
+    n = len(T)
+    if n == 1:
+        return np.array([0, 0])
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+
+        distances = segment_distances(T[start + 1:end], T[start], T[end])
+        index = int(np.argmax(distances))
+        if distances[index] >= epsilon:
+            index += start + 1
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+
+    return np.flatnonzero(keep)
+
+
+def thresholds(T):
+    """Returns, for each point of T, the largest epsilon for which the point survives the simplification.
+
+    A point is kept exactly when its own split error and the split errors of all the segments that contain
+    it are at least epsilon, so its threshold is the minimum of these errors.
+    """
+    T = np.asarray(T, dtype=float).reshape(-1, 2)
+    n = len(T)
+
+    # Interior points that are never split off (zero error) are only kept when epsilon is 0
+    removal = np.zeros(n)
+    removal[0] = removal[-1] = np.inf
+
+    stack = [(0, n - 1, np.inf)]
+    while stack:
+        start, end, parent = stack.pop()
+        if end - start < 2:
+            continue
+
+        distances = segment_distances(T[start + 1:end], T[start], T[end])
+        index = int(np.argmax(distances))
+        if distances[index] > 0:
+            threshold = min(distances[index], parent)
+            index += start + 1
+            removal[index] = threshold
+            stack.append((start, index, threshold))
+            stack.append((index, end, threshold))
+
+    return removal
+
+
+def select(T, removal, epsilon):
+    """Returns the epsilon-simplification of T given the removal thresholds of its points."""
+    if len(T) == 1:
+        return [T[0], T[0]]
+
+    return [T[i] for i in np.flatnonzero(removal >= epsilon)]
+
+
+def simplify_many(T, epsilons):
+    """Returns the epsilon-simplification of T for every epsilon in epsilons, splitting T only once."""
+    removal = thresholds(T)
+
+    return {epsilon : select(T, removal, epsilon) for epsilon in epsilons}
@@ -0,0 +1,69 @@
+import csv
+import numpy as np
+from itertools import islice
+
+# Number of csv rows held in memory at a time
+CHUNK_SIZE = 100000
+
+
+def point_chunks(csv_path, tid_column=0, chunk_size=CHUNK_SIZE):
+    """Yields (tids, points) for consecutive chunks of at most chunk_size rows of the csv file.
+
+    tids is a string array and points an (n, 2) float array; the trajectory id is in column tid_column,
+    followed by x and y.
+    """
+    with open(csv_path) as file:
+        next(file)
+        reader = csv.reader(file, delimiter=",")
+
+        while True:
+            rows = list(islice(reader, chunk_size))
+            if not rows:
+                return
+
+            columns = list(zip(*rows))
+            points = np.empty((len(rows), 2))
+            points[:, 0] = np.array(columns[tid_column + 1], dtype=float)
+            points[:, 1] = np.array(columns[tid_column + 2], dtype=float)
+
+            yield np.array(columns[tid_column]), points
+
+
+def stream_trajectories(csv_path, tid_column=0, tids=None, chunk_size=CHUNK_SIZE, contiguous=True):
+    """Yields (tid, trajectory) for every trajectory of the csv file (or only those in tids), as lists of (x, y) tuples.
+
+    Only the current chunk and the trajectory being assembled are held in memory, so the points of each
+    trajectory must be contiguous in the file; a trajectory split over several runs of rows is yielded once
+    per run.  With contiguous=False, rows are grouped by trajectory wherever they are in the file, as
+    store.load does, which holds every point in memory.
+    """
+    if not contiguous:
+        # Imported here, since store reads its csv files with point_chunks
+        from store import load
+
+        store = load(csv_path, tid_column)
+        for tid in store.index:
+            if tids is None or tid in tids:
+                yield tid, store.tuples(tid)
+        return
+
+    current, pending = None, []
+
+    for chunk_tids, points in point_chunks(csv_path, tid_column, chunk_size):
+        xs, ys = points[:, 0].tolist(), points[:, 1].tolist()
+
+        # Rows where the trajectory id changes split the chunk into runs of one trajectory each
+        starts = np.concatenate(([0], np.flatnonzero(chunk_tids[1:] != chunk_tids[:-1]) + 1, [len(chunk_tids)]))
+        for start, end in zip(starts[:-1].tolist(), starts[1:].tolist()):
+            tid = str(chunk_tids[start])
+
+            if tid != current:
+                if current is not None and (tids is None or current in tids):
+                    yield current, pending
+                current, pending = tid, []
+
+            if tids is None or tid in tids:
+                pending.extend(zip(xs[start:end], ys[start:end]))
+
+    if current is not None and (tids is None or current in tids):
+        yield current, pending
@@ -1,109 +1,72 @@
-import csv
+import numpy as np
 
-def distance2(p, q):
-    return (p[0] - q[0])**2 + (p[1] - q[1])**2
+import instrument
+from dtw import as_array, dtw_batch, dtw_kernel, fast_dtw
+from simplify import greedy_indices
+from store import load
 
+# Maximum number of points stacked in one dtw_batch call by dtw_distances
+BATCH_POINTS = 1000000
 
-def distance(p, q):
-    return distance2(p, q)**0.5
 
+def dtw_distance(P, Q, window=None, slope=None, cutoff=None, radius=None):
+    # inf once the distance is certain to exceed cutoff, which then stops the evaluation early
+    if radius is None:
+        dtw, size = dtw_kernel(P, Q, window=window, slope=slope, cutoff=cutoff)
+    elif window is not None or slope is not None:
+        raise ValueError("radius cannot be combined with window or slope")
+    else:
+        dtw, size = fast_dtw(P, Q, radius, cutoff=cutoff)
 
-def dtw_distance(P, Q):
-    n, m = len(P), len(Q)
-
-    distances, sizes, dtws = [[0 for i in range(m)] for j in range(n)], [[0 for i in range(m)] for j in range(n)], [[0 for i in range(m)] for j in range(n)]
-
-    for i in range(n):
-        for j in range(m):
-            distances[i][j] = distance2(P[i], Q[j])
-
-    sizes[0][0] = 1
-    dtws[0][0] = distances[0][0]
-
-    for i in range(1, n):
-        sizes[i][0] = sizes[i - 1][0] + 1
-        dtws[i][0] = (distances[i][0] + sizes[i - 1][0] * dtws[i - 1][0]) / (sizes[i - 1][0] + 1)
-
-    for j in range(1, m):
-        sizes[0][j] = sizes[0][j - 1] + 1
-        dtws[0][j] = (distances[0][j] + sizes[0][j - 1] * dtws[0][j - 1]) / (sizes[0][j - 1] + 1)
-
-    for i in range(1, n):
-        for j in range(1, m):
-            candidates = [(distances[i][j] + sizes[i - 1][j] * dtws[i - 1][j]) / (sizes[i - 1][j] + 1),
-                          (distances[i][j] + sizes[i][j - 1] * dtws[i][j - 1]) / (sizes[i][j - 1] + 1),
-                          (distances[i][j] + sizes[i - 1][j - 1] * dtws[i - 1][j - 1]) / (sizes[i - 1][j - 1] + 1)]
-            if candidates[0] == min(candidates):
-                sizes[i][j] = sizes[i - 1][j] + 1
-            elif candidates[1] == min(candidates):
-                sizes[i][j] = sizes[i][j - 1] + 1
-            else:
-                sizes[i][j] = sizes[i - 1][j - 1] + 1
-            dtws[i][j] = min(candidates)
-
-    return (dtws[n - 1][m - 1] / sizes[n - 1][m - 1])**0.5
-
+    return (dtw / size)**0.5
 
-def calculate_distance(point, segment):
-    a, b = segment
-    segment_length_squared = distance2(a, b)
 
-    if segment_length_squared == 0:
-        return min(distance(point, a), distance(point, b))
+def dtw_distances(P, candidates, window=None, slope=None, cutoff=None, nearest=False, reverse=False):
+    # dtw_distance(P, Q) for every candidate Q, or dtw_distance(Q, P) with reverse, scored in batches by dtw_batch.
+    # cutoff is a number or one per candidate; with nearest, candidates that cannot be the closest are abandoned too.
+    P = as_array(P)
+    candidates = [as_array(Q) for Q in candidates]
+    cutoffs = np.broadcast_to(np.inf if cutoff is None else np.asarray(cutoff, dtype=float), (len(candidates),))
+    distances = [float("inf")] * len(candidates)
 
-    t = ((point[0] - a[0]) * (b[0] - a[0]) + (point[1] - a[1]) * (b[1] - a[1])) / segment_length_squared
+    # Candidates of similar lengths are batched together, so that little padding is computed
+    order = sorted(range(len(candidates)), key=lambda c: len(candidates[c]))
+    start = 0
+    while start < len(order):
+        end = start + 1
+        while end < len(order) and (end + 1 - start) * (len(P) + len(candidates[order[end]])) <= BATCH_POINTS:
+            end += 1
+        batch = order[start:end]
 
-    if t < 0:
-        return distance(point, a)
-    elif t > 1:
-        return distance(point, b)
+        limits = cutoffs[batch]
+        if nearest:
+            limits = np.minimum(limits, min(distances))
+        Ps, Qs = [P] * len(batch), [candidates[c] for c in batch]
+        if reverse:
+            Ps, Qs = Qs, Ps
+        dtws, sizes = dtw_batch(Ps, Qs, window, slope, limits if cutoff is not None or nearest else None, nearest)
 
-    closest_point = (a[0] + t * (b[0] - a[0]), a[1] + t * (b[1] - a[1]))
+        for c, dtw, size in zip(batch, dtws.tolist(), sizes.tolist()):
+            distances[c] = (dtw / size)**0.5
+        start = end
 
-    return distance(point, closest_point)
+    return distances
 
 
 def ts_greedy(trajectory, epsilon):
     if epsilon == 0:
         return trajectory
 
-    ret = []
-    index = 0
-    error = 0
-    for i in range(1, len(trajectory) - 1):
-        distance = calculate_distance(trajectory[i], (trajectory[0], trajectory[-1]))
-        if distance > error:
-            index = i
-            error = distance
-
-    if error >= epsilon:
-        recursion_1 = ts_greedy(trajectory[:index+1], epsilon)[:-1]
-        recursion_2 = ts_greedy(trajectory[index:], epsilon)
-        ret = recursion_1 + recursion_2
-    else:
-        ret = [trajectory[0], trajectory[-1]]
+    with instrument.span("ts_greedy", points=len(trajectory), epsilon=epsilon):
+        simplified = [trajectory[i] for i in greedy_indices(trajectory, epsilon)]
+
+    if instrument.enabled:
+        instrument.record("ts_greedy.ratio", len(trajectory) / len(simplified))
 
-    return ret
+    return simplified
 
 
 def read_csv(csv_path, tids=None):
-    trajectories = {}
-
-    with open(csv_path) as file:
-        reader = csv.reader(file, delimiter=",")
-
-        next(file)
-        for row in reader:
-            tid = row[0]
-
-            if tids is None:
-                if tid not in trajectories:
-                    trajectories[tid] = []
-                trajectories[tid].append((float(row[1]), float(row[2])))
-            else:
-                if tid in tids:
-                    if tid not in trajectories:
-                        trajectories[tid] = []
-                    trajectories[tid].append((float(row[1]), float(row[2])))
-
-    return trajectories
\ No newline at end of file
+    store = load(csv_path)
+
+    return {tid : store.tuples(tid) for tid in store.index if tids is None or tid in tids}